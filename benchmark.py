@@ -0,0 +1,266 @@
+import argparse
+import json
+import os
+import pickle
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import generate
+import py_parser
+
+# benchmarks for the parser
+#   python benchmark.py stages [--users N --machines N --files N --days N] [--output results.json]
+#       [--compare old.json]
+#     generates a log and times every stage of the report on it separately
+#   python benchmark.py similarity [number of users ...]
+#     compares the MinHash/LSH file similarity (approxSimilarPairs) with the exact
+#     sparse one (similarPairs) on synthetic users
+#   python benchmark.py scaling [--workers N ...] [--users N --days N]
+#     generates a log and times a sharded ingest with every number of workers, with
+#     the part the parent does alone (unpickling the shards and merging) on its own
+
+# users come in teams that read and write from a shared pool of files, plus a few
+# files of their own. Returns (file_counts, num_records) like main() builds them
+def syntheticFileAccesses(num_users, team_size=25, team_files=20, own_files=3, seed=0):
+    rng = np.random.default_rng(seed)
+    file_counts = []
+    num_records = []
+    for u in range(num_users):
+        team = u // team_size
+        counts = {}
+        for f in rng.choice(team_files, rng.integers(12, team_files + 1), replace=False).tolist():
+            counts["T" + str(team) + "F" + str(f) + ":R"] = int(rng.integers(1, 6))
+        for f in range(own_files):
+            counts["U" + str(u) + "F" + str(f) + ":RW"] = int(rng.integers(1, 3))
+        file_counts.append(counts)
+        num_records.append(sum(counts.values()) + int(rng.integers(0, 5))) # prints
+    return file_counts, num_records
+
+def benchmarkSimilarity(num_users, threshold=0.5, recall=0.95):
+    file_counts, num_records = syntheticFileAccesses(num_users)
+
+    start = time.perf_counter()
+    exact = py_parser.similarPairs(file_counts, num_records, threshold)
+    exact_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    approx = py_parser.approxSimilarPairs(file_counts, num_records, threshold, recall)
+    approx_time = time.perf_counter() - start
+
+    n = len(file_counts)
+    exact_keys = set((exact[0] * n + exact[1]).tolist())
+    approx_keys = set((approx[0] * n + approx[1]).tolist())
+    found = len(exact_keys & approx_keys) / len(exact_keys) if exact_keys else 1.0
+    print(str(num_users) + " users: " + str(len(exact_keys) // 2) + " similar pairs")
+    print("\texact:  " + str(round(exact_time, 2)) + "s")
+    print("\tminhash: " + str(round(approx_time, 2)) + "s, recall " + str(round(found, 4))
+    + " (asked for " + str(recall) + "), " + str(len(approx_keys - exact_keys)) + " wrong pairs")
+
+# ---- per stage benchmark
+
+# runs func once for time and, if memory is set, once more under tracemalloc for its
+# peak allocation (tracing slows Python code down, so it is kept out of the timing).
+# Stages have to give the same result when run twice
+def measure(name, func, items, memory=True):
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    result = func()
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    peak = None
+    if memory:
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    stage = {"name": name, "wall_seconds": wall, "cpu_seconds": cpu, "peak_bytes": peak,
+    "items": items(result) if callable(items) else items}
+    return result, stage
+
+def rawTimestamps(path):
+    dates = []
+    times = []
+    for parts in py_parser.splitLines(py_parser.readLines(path)):
+        dates.append(parts[3])
+        times.append(parts[4])
+    return dates, times
+
+def robustAll(dataset, order):
+    dataset.logins.summaries = {}
+    dataset.messages.summaries = {}
+    for user in order:
+        for name in ["duration", "ave_proc", "max_proc", "chars_typed", "cpu", "login_of_day", "logout_of_day"]:
+            dataset.logins.robust(user, name)
+        for name in ["bytes", "attachments", "start_of_day"]:
+            dataset.messages.robust(user, name)
+    dataset.prints.summaries = {}
+    return [dataset.prints.robust(user, "pages").trimmed_mean for user in order]
+
+def userAverages(dataset):
+    averages = []
+    for i in dataset.userOrder():
+        user = dataset.type_one_users[i]
+        averages.append([user.total_time / user.num_records, user.longest_day, user.total_ave_proc / user.num_records,
+        user.total_max_proc / user.num_records, user.total_chars_typed / user.num_records,
+        user.total_cpu / user.num_records] + user.days_worked)
+    return averages
+
+def clusterAll(dataset, order):
+    points = []
+    for user in order:
+        points.append([dataset.logins.robust(user, name).trimmed_mean for name in ["ave_proc", "max_proc", "chars_typed", "cpu"]])
+    return py_parser.kMeansSweep(py_parser.normalize(points), range(2, 6))
+
+# the distinct (address, direction) pairs of every user, straight from the columns
+def distinctAddresses(dataset):
+    messages = dataset.messages
+    keys = (messages.column("user").astype(np.int64) * len(dataset.addresses) + messages.column("address")) \
+    * len(dataset.directions) + messages.column("direction")
+    return np.unique(keys)
+
+def emailGraphQueries(dataset):
+    graph = py_parser.emailGraph(dataset)
+    return graph.contactCounts(), graph.components(), graph.heaviestEdges(py_parser.EMAIL_GRAPH_TOP)
+
+def similaritySweep(file_counts, num_records):
+    left, right, similarity = py_parser.similarPairs(file_counts, num_records, 0.5)
+    counts = []
+    threshold = 0.5
+    while threshold <= 1:
+        counts.append(int(np.count_nonzero(similarity >= threshold)))
+        threshold += .1
+    return counts
+
+def gitCommit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+# generates a log, runs every stage of the report on it and returns the results
+# as a dict ready for json
+def benchmarkStages(num_users=1000, num_machines=50, files_per_user=20, days=30, seed=0, workers=1, memory=True):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "log.csv")
+    try:
+        records = generate.generateLog(path, num_users, num_machines, files_per_user, days, seed)
+        stages = []
+        dataset, stage = measure("ingest", lambda: py_parser.ingest(path, workers), records, memory)
+        stages.append(stage)
+        dates, times = rawTimestamps(path)
+        stages.append(measure("timestamp decode", lambda: py_parser.decodeTimestamps(dates, times), records, memory)[1])
+    finally:
+        os.remove(path)
+        os.rmdir(directory)
+    order = dataset.userOrder()
+    resources = [dataset.resources[i] for i in order]
+    file_counts = [r.file_counts for r in resources]
+    num_records = [r.num_records for r in resources]
+    stages.append(measure("per-user statistics", lambda: userAverages(dataset), len(order), memory)[1])
+    stages.append(measure("outlier trimming", lambda: robustAll(dataset, order),
+    len(dataset.logins) + len(dataset.messages), memory)[1])
+    stages.append(measure("machine matrix", lambda: py_parser.machineMatrix(dataset, order), len(order), memory)[1])
+    stages.append(measure("k-means", lambda: clusterAll(dataset, order), len(order), memory)[1])
+    stages.append(measure("file similarity sweep", lambda: similaritySweep(file_counts, num_records), len(order), memory)[1])
+    stages.append(measure("subset check", lambda: py_parser.fileSupersets(file_counts), len(order), memory)[1])
+    stages.append(measure("email dedup", lambda: distinctAddresses(dataset), len(dataset.messages), memory)[1])
+    stages.append(measure("email graph", lambda: emailGraphQueries(dataset), len(dataset.messages), memory)[1])
+    return {"commit": gitCommit(), "python": platform.python_version(), "numpy": np.__version__,
+    "params": {"users": num_users, "machines": num_machines, "files": files_per_user, "days": days, "seed": seed,
+    "workers": workers}, "records": records, "stages": stages}
+
+# ---- ingest scaling
+
+# wall time of ingest() with each number of workers on one generated log, and the
+# serial share of the parent: loading the shards' packs and merging them
+def benchmarkScaling(worker_counts, num_users=2000, days=60, seed=0):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "log.csv")
+    min_shard_bytes = py_parser.MIN_SHARD_BYTES
+    try:
+        records = generate.generateLog(path, num_users, 50, 20, days, seed)
+        size = os.path.getsize(path)
+        py_parser.MIN_SHARD_BYTES = max(1, size // max(worker_counts)) # a shard per worker
+        print(str(records) + " records, " + str(round(size / 1e6, 1)) + " MB, " + str(os.cpu_count()) + " CPUs")
+        print("%8s %10s %10s %12s %12s" % ("workers", "wall s", "speedup", "parent s", "sent MB"))
+        first = None
+        for workers in worker_counts:
+            start = time.perf_counter()
+            py_parser.ingest(path, workers)
+            wall = time.perf_counter() - start
+            first = first or wall
+            shards = [(path, s, e, False, py_parser.RECORD_TYPES)
+                      for s, e in py_parser.shardRanges(path, workers)]
+            sent = [pickle.dumps(py_parser.ingestShardPacked(shard)) for shard in shards]
+            start = time.perf_counter()
+            if len(sent) > 1:
+                py_parser.mergePacks([pickle.loads(blob) for blob in sent])
+            parent = time.perf_counter() - start
+            print("%8d %10.2f %10.2f %12.2f %12.1f" % (workers, wall, first / wall, parent,
+            sum(len(blob) for blob in sent) / 1e6 if len(sent) > 1 else 0))
+    finally:
+        py_parser.MIN_SHARD_BYTES = min_shard_bytes
+        os.remove(path)
+        os.rmdir(directory)
+
+def printStages(results, baseline=None):
+    before = {}
+    if baseline is not None:
+        for stage in baseline["stages"]:
+            before[stage["name"]] = stage
+    print(str(results["records"]) + " records, " + str(results["params"]["users"]) + " users")
+    print("%-24s %10s %10s %12s %12s" % ("stage", "wall s", "cpu s", "peak MB", "items/s"))
+    for stage in results["stages"]:
+        peak = "-" if stage["peak_bytes"] is None else "%.1f" % (stage["peak_bytes"] / 1e6)
+        line = "%-24s %10.4f %10.4f %12s %12.0f" % (stage["name"], stage["wall_seconds"], stage["cpu_seconds"], peak,
+        stage["items"] / max(stage["wall_seconds"], 1e-9))
+        if stage["name"] in before:
+            line += "  x%.2f" % (stage["wall_seconds"] / max(before[stage["name"]]["wall_seconds"], 1e-9))
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for py_parser")
+    commands = parser.add_subparsers(dest="command", required=True)
+    stages = commands.add_parser("stages", help="time and memory of every report stage on a generated log")
+    stages.add_argument("--users", type=int, default=1000)
+    stages.add_argument("--machines", type=int, default=50)
+    stages.add_argument("--files", type=int, default=20)
+    stages.add_argument("--days", type=int, default=30)
+    stages.add_argument("--seed", type=int, default=0)
+    stages.add_argument("--workers", type=int, default=1)
+    stages.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    stages.add_argument("--output", help="write the results to this json file")
+    stages.add_argument("--compare", help="json file of an earlier run to compare wall times with")
+    similarity = commands.add_parser("similarity", help="exact vs MinHash file similarity")
+    similarity.add_argument("sizes", type=int, nargs="*", default=[10000, 100000])
+    scaling = commands.add_parser("scaling", help="sharded ingest time with more and more workers")
+    scaling.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    scaling.add_argument("--users", type=int, default=2000)
+    scaling.add_argument("--days", type=int, default=60)
+    scaling.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == "similarity":
+        for num_users in args.sizes:
+            benchmarkSimilarity(num_users)
+        return
+    if args.command == "scaling":
+        benchmarkScaling(args.workers, args.users, args.days, args.seed)
+        return
+    results = benchmarkStages(args.users, args.machines, args.files, args.days, args.seed, args.workers,
+    not args.no_memory)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    printStages(results, baseline)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=1)
+
+if __name__ == "__main__":
+    main()
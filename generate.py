@@ -0,0 +1,142 @@
+import argparse
+import datetime
+import numpy as np
+
+# writes a synthetic log in the layout of sorted-proj-data.csv: type 1 (login
+# sessions), type 2 (file accesses and prints) and type 3 (email) records, sorted by
+# type and then by day like the sample
+# usage: python generate.py out.csv [--users N] [--machines N] [--files N] [--days N]
+
+START_DATE = datetime.date(2008, 9, 1)
+TEAM_SIZE = 25 # users in a team share a pool of files
+PRINTERS = 5
+EMAIL_PROGRAMS = 3
+ADDRESSES = ["jones@pqr.com", "smith@abc.org", "brown@xyz.net", "lee@pqr.com", "garcia@abc.org",
+"miller@xyz.net", "davis@pqr.com", "wilson@abc.org"]
+FIELDS = 16
+
+def hhmmss(seconds):
+    return ["%02d%02d%02d" % (s // 3600, s // 60 % 60, s % 60) for s in seconds.tolist()]
+
+def pad(parts):
+    return ",".join(parts) + "," * (FIELDS - len(parts)) + "\n"
+
+# ids are zero padded to at least two digits like the sample (U01, M01)
+def names(prefix, count):
+    width = max(2, len(str(count)))
+    return [prefix + str(i + 1).zfill(width) for i in range(count)]
+
+# every user logs in, prints and sends mail at least twice over the first two days
+# so that every statistic in the report is defined
+def loginLines(rng, day, date, users, machines, home):
+    n = len(users)
+    present = rng.random(n) < (0.9 if day % 7 < 5 else 0.1)
+    if day < 2:
+        present[:] = True
+    idx = np.flatnonzero(present)
+    login = np.clip(rng.normal(8 * 3600, 2400, len(idx)), 0, 12 * 3600).astype(np.int64)
+    logout = np.minimum(login + np.clip(rng.normal(9 * 3600, 3600, len(idx)), 600, None).astype(np.int64), 86399)
+    roam = rng.random(len(idx)) < 0.1
+    machine = np.where(roam, rng.integers(0, len(machines), len(idx)), home[idx])
+    num_proc = rng.integers(10, 40, len(idx))
+    max_proc = num_proc + rng.integers(20, 60, len(idx))
+    chars = np.maximum(rng.normal(12000, 3000, len(idx)), 0).astype(np.int64)
+    cpu = np.maximum(rng.normal(12000, 2500, len(idx)), 0).astype(np.int64)
+    lines = []
+    for u, m, a, b, p, q, c, k in zip(idx.tolist(), machine.tolist(), hhmmss(login), hhmmss(logout),
+    num_proc.tolist(), max_proc.tolist(), chars.tolist(), cpu.tolist()):
+        lines.append(pad(["1", users[u], machines[m], date, a, b, str(p), str(q), str(c), str(k)]))
+    return lines
+
+def accessLines(rng, day, date, users, machines, home, files_per_user):
+    n = len(users)
+    counts = rng.poisson(3, n)
+    if day < 2:
+        counts = np.maximum(counts, 1)
+    user = np.repeat(np.arange(n), counts)
+    m = len(user)
+    start = rng.integers(8 * 3600, 18 * 3600, m)
+    duration = rng.integers(10, 3000, m)
+    program = rng.integers(0, 100, m)
+    # half of the files come from the team's pool, the rest are the user's own
+    shared = rng.random(m) < 0.5
+    team = user // TEAM_SIZE
+    file = np.where(shared, team * files_per_user + rng.integers(0, files_per_user, m),
+    (n // TEAM_SIZE + 1 + user) * files_per_user + rng.integers(0, files_per_user, m))
+    permission = rng.integers(0, 3, m)
+    prints = rng.random(m) < 0.3
+    if day < 2:
+        prints[np.searchsorted(user, np.arange(n))] = True
+    printer = rng.integers(1, PRINTERS + 1, m)
+    pages = rng.integers(1, 50, m)
+    order = np.argsort(start, kind="stable")
+    lines = []
+    width = len(str((n // TEAM_SIZE + 1 + n) * files_per_user))
+    starts = hhmmss(start)
+    durations = hhmmss(duration)
+    for i in order.tolist():
+        parts = ["2", users[user[i]], machines[home[user[i]]], date, starts[i], "LP" + str(program[i]).zfill(3), durations[i],
+        "F" + str(file[i]).zfill(width), ("R", "W", "RW")[permission[i]]]
+        if prints[i]:
+            parts += ["PR" + str(printer[i]), str(pages[i])]
+        lines.append(pad(parts))
+    return lines
+
+def emailLines(rng, day, date, users, machines, home):
+    n = len(users)
+    counts = rng.poisson(2, n)
+    if day < 2:
+        counts = np.maximum(counts, 1)
+    user = np.repeat(np.arange(n), counts)
+    m = len(user)
+    start = rng.integers(7 * 3600, 19 * 3600, m)
+    program = rng.integers(1, EMAIL_PROGRAMS + 1, m)
+    address = rng.integers(0, len(ADDRESSES), m)
+    sent = rng.random(m) < 0.5
+    size = rng.lognormal(9, 1.5, m).astype(np.int64) + 100
+    attachments = rng.poisson(0.5, m)
+    order = np.argsort(start, kind="stable")
+    starts = hhmmss(start)
+    lines = []
+    for i in order.tolist():
+        lines.append(pad(["3", users[user[i]], machines[home[user[i]]], date, starts[i], "E" + str(program[i]),
+        ADDRESSES[address[i]], "S" if sent[i] else "R", str(size[i]), str(attachments[i])]))
+    return lines
+
+# writes the log to path and returns the number of records written
+def generateLog(path, num_users=100, num_machines=20, files_per_user=20, days=30, seed=0):
+    rng = np.random.default_rng(seed)
+    users = names("U", num_users)
+    machines = names("M", num_machines)
+    home = np.arange(num_users) % num_machines
+    dates = [(START_DATE + datetime.timedelta(days=d)).strftime("%m%d%y") for d in range(days)]
+    written = 0
+    with open(path, "w") as file:
+        for day in range(days):
+            lines = loginLines(rng, day, dates[day], users, machines, home)
+            file.writelines(lines)
+            written += len(lines)
+        for day in range(days):
+            lines = accessLines(rng, day, dates[day], users, machines, home, files_per_user)
+            file.writelines(lines)
+            written += len(lines)
+        for day in range(days):
+            lines = emailLines(rng, day, dates[day], users, machines, home)
+            file.writelines(lines)
+            written += len(lines)
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic log in the layout of sorted-proj-data.csv")
+    parser.add_argument("path")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--machines", type=int, default=20)
+    parser.add_argument("--files", type=int, default=20, help="files in each user's own and team pools")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    written = generateLog(args.path, args.users, args.machines, args.files, args.days, args.seed)
+    print(str(written) + " records written to " + args.path)
+
+if __name__ == "__main__":
+    main()
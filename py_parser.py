@@ -1,10 +1,30 @@
+import argparse
+import asyncio
+import collections
 import datetime
 import numpy as np
-import statistics
-import math
-import copy
+import os
+import multiprocessing
+import hashlib
+import heapq
+import json
+import shutil
+import sys
+import time
+import tracemalloc
+import zipfile
+import xml.etree.ElementTree as ElementTree
+try:
+    import resource # not on windows; max_rss is left out there
+except ImportError:
+    resource = None
 
 
+# raw values for every record live in a ColumnStore (one per record type); the
+# User/Resource/Email objects only keep running per-user aggregates. mergeDatasets()
+# folds together the datasets of consecutive parts of the same log, so a log split
+# into pieces and merged in order gives the same result as reading it in one go
+
 class User:
     def __init__(self, uid):
         self.user_id = uid
@@ -12,21 +32,14 @@ class User:
         self.total_time = 0
         self.longest_day = 0
         self.total_ave_proc = 0
-        self.ave_procs = []
         self.max_proc = 0
-        self.max_proc_l = []
         self.total_max_proc = 0
-        self.machines = []
-        self.logins = []
-        self.logouts = []
+        self.machines = {} # machine id -> sessions, in order of first use
         self.total_chars_typed = 0
-        self.chars_typed = []
         self.max_chars_typed = 0
         self.total_cpu = 0
-        self.cpus = []
         self.max_cpu = 0
         self.days_worked = [] # days of week worked. Monday = 0
-        self.times = []
         for i in range(0, 7):
             self.days_worked.append(0)
         
@@ -36,38 +49,29 @@ class User:
         
     def inc_total_time(self, time):
         self.total_time += time
-        self.times.append(time)
         if time > self.longest_day:
             self.longest_day = time
 
     def inc_ave_proc(self, ave_proc):
-        self.ave_procs.append(ave_proc)
         self.total_ave_proc += ave_proc
         
     def inc_max_proc(self, max_proc): 
         self.total_max_proc += max_proc
-        self.max_proc_l.append(max_proc)
         if max_proc > self.max_proc:
             self.max_proc = max_proc
     
     def add_machine(self, machine):
-        self.machines.append(machine)
+        self.machines[machine] = self.machines.get(machine, 0) + 1
         
     def add_login(self, login):
-        self.logins.append(login)
-        self.days_worked[login.weekday()] += 1
-        
-    def add_logout(self, logout):
-        self.logouts.append(logout)
+        self.days_worked[weekday(login)] += 1
         
     def inc_chars_typed(self, chars_typed):
-        self.chars_typed.append(chars_typed)
         self.total_chars_typed += chars_typed
         if chars_typed > self.max_chars_typed:
             self.max_chars_typed = chars_typed
             
     def inc_cpu(self, cpu):
-        self.cpus.append(cpu)
         self.total_cpu += cpu
         if cpu > self.max_cpu:
             self.max_cpu = cpu
@@ -78,24 +82,15 @@ class Resource:
         self.num_records = 0
         self.accesses = 0
         self.printed = 0
-        self.machines = []
-        self.start_times = []
-        self.durations = []
-        self.programs = []
-        self.files = []
-        self.printers = []
+        self.machines = {} # machine id -> records
+        self.file_counts = {} # (file id, permission id) -> number of accesses, in order of first access
+        self.printers = {} # printer id -> prints
     def addMachine(self, machine):
-        self.machines.append(machine)
-    def addStartTime(self, st):
-        self.start_times.append(st)
-    def addDuration(self, dr):
-        self.durations.append(dr)
-    def addProgram(self, prg):
-        self.programs.append(prg)
-    def addFile(self, f):
-        self.files.append(f)
+        self.machines[machine] = self.machines.get(machine, 0) + 1
+    def addFile(self, f, permission):
+        self.file_counts[(f, permission)] = self.file_counts.get((f, permission), 0) + 1
     def addPrinter(self, p):
-        self.printers.append(p)
+        self.printers[p] = self.printers.get(p, 0) + 1
     def incNumRecord(self):
         self.num_records += 1
     def incNumPrintRecord(self):
@@ -106,30 +101,528 @@ class Resource:
 class Email:
     def __init__(self, uid):
         self.user_id = uid
-        self.machines = []
-        self.start_times = []
-        self.email_programs = []
-        self.emails = [] # addresses; S/R
-        self.bites = []
-        self.attachments = []
+        self.machines = {} # machine id -> emails, in order of first use
+        self.programs = {} # program id -> emails
+        self.addresses = {} # (address id, direction id) -> emails
         self.count = 0
     def addMachine(self, machine):
-        self.machines.append(machine)
-    def addStartTime(self, st):
-        self.start_times.append(st)
+        self.machines[machine] = self.machines.get(machine, 0) + 1
     def addEmailProgram(self, prog):
-        self.email_programs.append(prog)
-    def addBytes(self, b):
-        self.bites.append(b)
+        self.programs[prog] = self.programs.get(prog, 0) + 1
     def incCount(self):
         self.count += 1
-    def addEmail(self, em):
-        self.emails.append(em)
-    def addAttachments(self, att):
-        self.attachments.append(att)
-            
-          
-          
+    def addEmail(self, address, direction):
+        self.addresses[(address, direction)] = self.addresses.get((address, direction), 0) + 1
+
+# hands out dense integer ids (0, 1, 2, ...) to strings in the order they are first seen
+class Interner:
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name):
+        i = self.ids.get(name)
+        if i is None:
+            i = len(self.names)
+            self.ids[name] = i
+            self.names.append(name)
+        return i
+
+    # our ids for a list of names, e.g. all of another interner's names
+    def internAll(self, names):
+        return np.array([self.intern(name) for name in names], dtype=np.int64)
+
+# sorts U2 before U10
+def naturalKey(name):
+    digits = name.lstrip("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz")
+    if digits.isdigit():
+        return (name[:len(name) - len(digits)], int(digits), name)
+    return (name, 0, name)
+
+# typed columns for one record type. Rows go into fixed size chunks so appending
+# never copies what is already stored; column() joins the chunks on demand.
+# derived maps extra column names to (source column, function of that column).
+# robust() summarizes a column for every user at once and keeps that until the
+# store gets new rows
+class ColumnStore:
+    CHUNK_ROWS = 4096
+
+    def __init__(self, columns, derived={}):
+        self.names = [c[0] for c in columns]
+        self.dtypes = dict(columns)
+        self.derived = derived
+        self.chunks = {name: [] for name in self.names}
+        self.fill = 0 # rows used in the last chunk
+        self.size = 0
+        self.cache = {}
+        self.summaries = {} # column -> RobustSummaries of every user
+
+    def __len__(self):
+        return self.size
+
+    def append(self, row):
+        if not self.chunks[self.names[0]] or self.fill == len(self.chunks[self.names[0]][-1]):
+            for name in self.names:
+                self.chunks[name].append(np.zeros(self.CHUNK_ROWS, dtype=self.dtypes[name]))
+            self.fill = 0
+        for name, value in zip(self.names, row):
+            self.chunks[name][-1][self.fill] = value
+        self.fill += 1
+        self.size += 1
+        self.cache = {}
+        self.summaries = {}
+
+    # adds all rows of another store with the same columns after the rows of this one.
+    # ids maps id column names to arrays that turn the other store's ids into ours
+    def extend(self, other, ids={}):
+        if len(other) == 0:
+            return
+        for name in self.names:
+            chunks = self.chunks[name]
+            if chunks:
+                chunks[-1] = chunks[-1][:self.fill]
+            column = other.column(name)
+            if name in ids:
+                column = translateIds(column, ids[name])
+            chunks.append(column)
+        self.fill = len(other)
+        self.size += len(other)
+        self.cache = {}
+        self.summaries = {}
+
+    def column(self, name):
+        if name not in self.cache:
+            if name in self.derived:
+                source, func = self.derived[name]
+                self.cache[name] = func(self.column(source))
+                return self.cache[name]
+            chunks = self.chunks[name]
+            if len(chunks) == 1:
+                self.cache[name] = chunks[0][:self.fill] # no copy, e.g. a memory mapped file
+            elif chunks:
+                self.cache[name] = np.concatenate(chunks[:-1] + [chunks[-1][:self.fill]])
+            else:
+                self.cache[name] = np.zeros(0, dtype=self.dtypes[name])
+        return self.cache[name]
+
+    # replaces the contents with whole columns given as lists of arrays (name -> list),
+    # the arrays are used as they are
+    def load(self, chunks):
+        for name in self.names:
+            self.chunks[name] = list(chunks[name])
+        first = chunks[self.names[0]]
+        self.size = sum(len(c) for c in first)
+        self.fill = len(first[-1]) if first else 0
+        self.cache = {}
+        self.summaries = {}
+
+    # joins the chunks into one array per column, e.g. before the store is sent to
+    # another process
+    def compact(self):
+        self.load({name: [self.column(name)] for name in self.names})
+
+    # rows [start, end) of a column, only joining the chunks they are in
+    def tail(self, name, start):
+        chunks = self.chunks[name]
+        pieces = []
+        offset = 0
+        for i in range(len(chunks)):
+            length = self.fill if i == len(chunks) - 1 else len(chunks[i])
+            if offset + length > start:
+                pieces.append(chunks[i][max(start - offset, 0):length])
+            offset += length
+        if not pieces:
+            return np.zeros(0, dtype=self.dtypes[name])
+        return np.concatenate(pieces)
+
+    # the stored columns (not derived ones) a piece at a time, at most rows rows per
+    # piece, without joining chunks; yields a list of arrays in the order of names
+    def blocks(self, names, rows):
+        chunks = self.chunks[self.names[0]]
+        for i in range(len(chunks)):
+            length = self.fill if i == len(chunks) - 1 else len(chunks[i])
+            for s in range(0, length, rows):
+                yield [self.chunks[name][i][s:min(s + rows, length)] for name in names]
+
+    def robust(self, user, name):
+        if name not in self.summaries:
+            self.summaries[name] = RobustSummaries(self.column("user"), self.column(name))
+        return self.summaries[name].user(user)
+
+# -1 stands for "none" in an id column and stays -1
+def translateIds(column, ids):
+    ret_val = column.copy()
+    present = column >= 0
+    ret_val[present] = ids[column[present]]
+    return ret_val
+
+# quartiles and 1.5 * IQR fences of every user's values for one column at once (q1
+# and q3 are the medians of the lower and upper halves, the middle value in neither),
+# plus what is left after trimming. The values are sorted by (user, value) once; each
+# user's quartiles are then read at offsets into their run and the sums are
+# differences of one running sum, so there is no loop over users. Integer columns
+# sort as one int64 key, user * span + value, which is much faster than a lexsort
+class RobustSummaries:
+    def __init__(self, users, values):
+        n = int(users.max()) + 1 if len(users) else 0
+        low = int(values.min()) if len(values) and values.dtype.kind in "iu" else None
+        span = int(values.max()) - low + 1 if low is not None else 0
+        if low is not None and n * span < 1 << 62:
+            key = np.sort(users.astype(np.int64) * span + (values.astype(np.int64) - low))
+            users = key // span
+            values = key % span + low
+        else:
+            order = np.lexsort((values, users))
+            values = values[order]
+            users = users[order]
+        counts = np.bincount(users, minlength=n)
+        ends = np.cumsum(counts)
+        starts = ends - counts
+        half = counts // 2
+        # a single value has no halves to take the median of; use the value itself
+        lo = np.maximum((half - 1) // 2, 0)
+        hi = half // 2
+        last = np.maximum(ends - 1, 0)
+        upper_start = ends - half
+        if len(values):
+            q1 = (values[np.minimum(starts + lo, last)] + values[np.minimum(starts + hi, last)]) / 2
+            q3 = (values[np.minimum(upper_start + lo, last)] + values[np.minimum(upper_start + hi, last)]) / 2
+        else:
+            q1 = q3 = np.zeros(n)
+        self.q1 = np.where(counts > 0, q1, 0)
+        self.q3 = np.where(counts > 0, q3, 0)
+        iqr = self.q3 - self.q1
+        lower = self.q1 - (iqr * 1.5)
+        upper = self.q3 + (iqr * 1.5)
+        keep = (values >= lower[users]) & (values <= upper[users])
+        self.count = counts
+        self.total = runSums(values, starts, ends)
+        self.trimmed_sum = runSums(np.where(keep, values, 0), starts, ends)
+        self.trimmed_count = np.bincount(users[keep], minlength=n)
+        self.fields = None # the same per user as python numbers, made on first use
+
+    # one user's summary; a user without rows gets an empty one
+    def user(self, user):
+        if user >= len(self.count):
+            return RobustSummary(0.0, 0.0, 0, 0, 0, 0)
+        if self.fields is None:
+            self.fields = list(zip(self.q1.tolist(), self.q3.tolist(), self.total.tolist(), self.count.tolist(),
+            self.trimmed_sum.tolist(), self.trimmed_count.tolist()))
+        return RobustSummary(*self.fields[user])
+
+# sums of values[starts[i]:ends[i]] for every i, in the values' own dtype
+def runSums(values, starts, ends):
+    running = np.concatenate([np.zeros(1, dtype=values.dtype), np.cumsum(values)])
+    return running[ends] - running[starts]
+
+# one user's quartiles, fences and trimmed sums for one column
+class RobustSummary:
+    def __init__(self, q1, q3, total, count, trimmed_sum, trimmed_count):
+        self.q1 = q1
+        self.q3 = q3
+        self.iqr = q3 - q1
+        self.total = total
+        self.count = count
+        self.trimmed_sum = trimmed_sum
+        self.trimmed_count = trimmed_count
+        self.trimmed_mean = trimmed_sum / trimmed_count if trimmed_count else 0.0
+        self.error = 0.0 # exact
+
+# ---- sketch mode
+# keeps a KLL quantile sketch per (user, column) instead of every value, so memory
+# per user does not grow with the log. Sketches of different parts of a log merge.
+# Quartiles and trimmed means are then approximate: ranks are off by at most
+# SKETCH_ERROR * n (at ~99% confidence, the usual KLL bound for this k)
+
+SKETCH_K = 200
+SKETCH_ERROR = 2.296 / SKETCH_K ** 0.9723
+
+class KLLSketch:
+    def __init__(self, k=SKETCH_K):
+        self.k = k
+        self.levels = [[]] # an item on level h stands for 2 ** h values
+        self.n = 0
+        self.total = 0
+        self.coin = 0 # which half of a compacted level moves up, alternates
+
+    def capacity(self, h):
+        return max(2, int(self.k * (2 / 3) ** (len(self.levels) - h - 1)))
+
+    def exact(self):
+        return len(self.levels) == 1
+
+    def update(self, value):
+        self.levels[0].append(value)
+        self.n += 1
+        self.total += value
+        if len(self.levels[0]) >= self.capacity(0):
+            self.compress()
+
+    # sorts each full level and moves every other item up one level
+    def compress(self):
+        h = 0
+        while h < len(self.levels):
+            level = self.levels[h]
+            if len(level) >= self.capacity(h):
+                if h + 1 == len(self.levels):
+                    self.levels.append([])
+                level.sort()
+                left = [level.pop()] if len(level) % 2 else [] # weight has to move in pairs
+                self.levels[h + 1].extend(level[self.coin::2])
+                self.coin ^= 1
+                self.levels[h] = left
+            h += 1
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for h in range(len(other.levels)):
+            self.levels[h].extend(other.levels[h])
+        self.n += other.n
+        self.total += other.total
+        self.compress()
+
+    # (values, weights) with the values sorted
+    def items(self):
+        values = []
+        weights = []
+        for h in range(len(self.levels)):
+            values.extend(self.levels[h])
+            weights.extend([2 ** h] * len(self.levels[h]))
+        values = np.array(values, dtype=float)
+        weights = np.array(weights, dtype=float)
+        order = np.argsort(values, kind="stable")
+        return values[order], weights[order]
+
+    def quantile(self, q):
+        values, weights = self.items()
+        cumulative = np.cumsum(weights)
+        return values[min(np.searchsorted(cumulative, q * cumulative[-1]), len(values) - 1)]
+
+# same fields as RobustSummary, read from a sketch
+class SketchSummary:
+    def __init__(self, sketch):
+        self.total = sketch.total
+        self.count = sketch.n
+        if sketch.n == 0:
+            self.q1 = self.q3 = self.iqr = 0
+            self.trimmed_sum = self.trimmed_count = 0
+            self.trimmed_mean = 0.0
+            self.error = 0.0
+            return
+        values, weights = sketch.items()
+        self.q1 = float(sketch.quantile(0.25))
+        self.q3 = float(sketch.quantile(0.75))
+        self.iqr = self.q3 - self.q1
+        keep = (values >= self.q1 - (self.iqr * 1.5)) & (values <= self.q3 + (self.iqr * 1.5))
+        self.trimmed_sum = float((values[keep] * weights[keep]).sum())
+        self.trimmed_count = int(weights[keep].sum())
+        self.trimmed_mean = self.trimmed_sum / self.trimmed_count if self.trimmed_count else 0.0
+        self.error = SKETCH_ERROR
+
+# stands in for a ColumnStore in sketch mode: rows are folded into the sketches as
+# they arrive and only robust() is available, there are no columns
+class SketchStore:
+    def __init__(self, columns, derived={}):
+        self.names = [c[0] for c in columns]
+        self.derived = derived
+        self.user_pos = self.names.index("user")
+        self.size = 0
+        self.sketches = {} # user -> {column: KLLSketch}
+        self.summaries = {} # user -> {column: summary}
+
+    def __len__(self):
+        return self.size
+
+    def append(self, row):
+        user = row[self.user_pos]
+        sketches = self.sketches.setdefault(user, {})
+        for name, value in zip(self.names, row):
+            if name not in ID_COLUMNS:
+                sketches.setdefault(name, KLLSketch()).update(value)
+        for name in self.derived:
+            source, func = self.derived[name]
+            sketches.setdefault(name, KLLSketch()).update(func(row[self.names.index(source)]))
+        self.size += 1
+        self.summaries.pop(user, None)
+
+    def extend(self, other, ids={}):
+        for user in other.sketches:
+            mine = int(ids["user"][user]) if "user" in ids else user
+            sketches = self.sketches.setdefault(mine, {})
+            for name in other.sketches[user]:
+                sketches.setdefault(name, KLLSketch()).merge(other.sketches[user][name])
+            self.summaries.pop(mine, None)
+        self.size += other.size
+
+    def robust(self, user, name):
+        summaries = self.summaries.setdefault(user, {})
+        if name not in summaries:
+            sketch = self.sketches.get(user, {}).get(name, KLLSketch())
+            if sketch.exact():
+                # nothing has been compacted yet, every value is still there
+                values = np.array(sketch.levels[0])
+                summaries[name] = RobustSummaries(np.zeros(len(values), dtype=np.int64), values).user(0)
+            else:
+                summaries[name] = SketchSummary(sketch)
+        return summaries[name]
+
+def secondsOfDay(times):
+    return times % 86400 # gets the time without day, month or year attached
+
+# times are stored as integer seconds since 1970-01-01. Id columns hold ids from the
+# Dataset's interner named here (-1 for none) and are not sketched. Categorical fields
+# are only ever stored as ids; the strings are in the interners, once each
+ID_COLUMNS = {"user": "users", "machine": "machines", "program": "programs", "file": "files", "permission": "permissions",
+              "printer": "printers", "address": "addresses", "direction": "directions"}
+LOGIN_COLUMNS = [("user", np.int32), ("machine", np.int32), ("duration", np.int64), ("ave_proc", np.int64), ("max_proc", np.int64),
+                 ("chars_typed", np.int64), ("cpu", np.int64), ("login", np.int64), ("logout", np.int64)]
+LOGIN_DERIVED = {"login_of_day": ("login", secondsOfDay), "logout_of_day": ("logout", secondsOfDay)}
+ACCESS_COLUMNS = [("user", np.int32), ("machine", np.int32), ("start_time", np.int64), ("duration", np.int64),
+                  ("program", np.int32), ("file", np.int32), ("printer", np.int32), ("permission", np.int16)]
+# one row per print, so robust("pages") only sees printed rows
+PRINT_COLUMNS = [("user", np.int32), ("printer", np.int32), ("pages", np.int64)]
+EMAIL_COLUMNS = [("user", np.int32), ("machine", np.int32), ("start_time", np.int64), ("bytes", np.int64),
+                 ("attachments", np.int64), ("program", np.int32), ("address", np.int32), ("direction", np.int16)]
+EMAIL_DERIVED = {"start_of_day": ("start_time", secondsOfDay)}
+ACCESS_DERIVED = {"start_of_day": ("start_time", secondsOfDay)}
+
+# everything parsed from a log. Users, machines, programs, files, permissions,
+# printers, email addresses and directions (S/R) get dense ids as they are first seen; type_one_users, resources and emails are
+# indexed by user id and grow with the population
+class Dataset:
+    def __init__(self, sketch=False):
+        self.users = Interner()
+        self.machines = Interner()
+        self.programs = Interner()
+        self.files = Interner()
+        self.permissions = Interner()
+        self.printers = Interner()
+        self.addresses = Interner()
+        self.directions = Interner()
+        self.type_one_users = []
+        self.resources = []
+        self.emails = []
+        store = SketchStore if sketch else ColumnStore
+        self.logins = store(LOGIN_COLUMNS, LOGIN_DERIVED)
+        self.accesses = store(ACCESS_COLUMNS, ACCESS_DERIVED)
+        self.messages = store(EMAIL_COLUMNS, EMAIL_DERIVED)
+        self.prints = store(PRINT_COLUMNS)
+
+    def userIndex(self, uid):
+        i = self.users.intern(uid)
+        if i == len(self.type_one_users):
+            self.type_one_users.append(User(uid))
+            self.resources.append(Resource(uid))
+            self.emails.append(Email(uid))
+        return i
+
+    # user ids sorted by user name, the order the report lists users in
+    def userOrder(self):
+        return sorted(range(len(self.users)), key=lambda i: naturalKey(self.users.names[i]))
+
+# ---- merging datasets
+# a dataset goes between processes packed into arrays: the interners' names, every
+# number of the Users, Resources or Emails as an array over user ids (users x entries
+# for a list) and every count dict as rows of [user id, key ids..., count] in the
+# dict's order, plus the stores. mergePacks() adds up all packs at once with NumPy and
+# builds each user's objects once, so merging does not loop over every user's
+# entries in Python once per part
+
+AGGREGATE_TYPES = {"type_one_users": User, "resources": Resource, "emails": Email}
+# id columns of the keys of each count dict
+AGGREGATE_KEYS = {"machines": ["machine"], "file_counts": ["file", "permission"], "printers": ["printer"],
+                  "programs": ["program"], "addresses": ["address", "direction"]}
+AGGREGATE_MAXIMA = {"longest_day", "max_proc", "max_chars_typed", "max_cpu"} # merged with max, the rest add up
+
+def packAggregates(aggregates, cls):
+    pack = {}
+    for name, value in cls("").__dict__.items():
+        if name == "user_id":
+            continue
+        if isinstance(value, dict):
+            rows = [(u,) + (key if isinstance(key, tuple) else (key,)) + (count,)
+                    for u, aggregate in enumerate(aggregates) for key, count in getattr(aggregate, name).items()]
+            pack[name] = np.array(rows, dtype=np.int64).reshape(-1, len(AGGREGATE_KEYS[name]) + 2)
+        else:
+            pack[name] = np.array([getattr(aggregate, name) for aggregate in aggregates], dtype=np.int64).reshape(
+            (len(aggregates),) + np.shape(value))
+    return pack
+
+def packDataset(dataset):
+    return {"interners": {interner: getattr(dataset, interner).names for interner in ID_COLUMNS.values()},
+            "aggregates": {name: packAggregates(getattr(dataset, name), cls) for name, cls in AGGREGATE_TYPES.items()},
+            "stores": storeNames(dataset)}
+
+# sets field of every aggregate to the summed counts of the packed rows of all parts,
+# (rows, ids) pairs; keys stay in order of first use. sizes are the number of ids of
+# each id column
+def mergeCounts(aggregates, field, parts, sizes):
+    translated = []
+    for rows, ids in parts:
+        rows = rows.copy()
+        rows[:, 0] = ids["user"][rows[:, 0]]
+        for j, column in enumerate(AGGREGATE_KEYS[field]):
+            rows[:, j + 1] = ids[column][rows[:, j + 1]]
+        translated.append(rows)
+    rows = np.concatenate(translated)
+    if len(rows) == 0:
+        return
+    key = rows[:, 0].copy() # one int64 per (user, key ids), sorting a 2-d array by rows is slow
+    for j, column in enumerate(AGGREGATE_KEYS[field]):
+        key = key * sizes[column] + rows[:, j + 1]
+    unique, first, inverse = np.unique(key, return_index=True, return_inverse=True)
+    counts = np.bincount(inverse, weights=rows[:, -1], minlength=len(unique)).astype(np.int64)
+    order = np.argsort(first, kind="stable")
+    order = order[np.argsort(rows[first[order], 0], kind="stable")] # by user, then first use
+    keys = rows[first[order], :-1]
+    counts = counts[order].tolist()
+    bounds = np.searchsorted(keys[:, 0], np.arange(len(aggregates) + 1)).tolist()
+    if keys.shape[1] > 2:
+        key_list = list(zip(*keys[:, 1:].T.tolist()))
+    else:
+        key_list = keys[:, 1].tolist()
+    for u in range(len(aggregates)):
+        if bounds[u] < bounds[u + 1]:
+            setattr(aggregates[u], field, dict(zip(key_list[bounds[u]:bounds[u + 1]], counts[bounds[u]:bounds[u + 1]])))
+
+# one dataset with the records of packs, in order. The first pack's stores are kept
+# as they are (its ids stay the same), the others' rows are appended to them
+def mergePacks(packs, sketch=False):
+    dataset = Dataset(sketch)
+    ids = []
+    for pack in packs:
+        ids.append({name: getattr(dataset, interner).internAll(pack["interners"][interner]) for name, interner in ID_COLUMNS.items()})
+    sizes = {name: len(getattr(dataset, interner)) for name, interner in ID_COLUMNS.items()}
+    for name, cls in AGGREGATE_TYPES.items():
+        aggregates = [cls(uid) for uid in dataset.users.names]
+        for field, value in cls("").__dict__.items():
+            if field == "user_id":
+                continue
+            parts = [(pack["aggregates"][name][field], pack_ids) for pack, pack_ids in zip(packs, ids)]
+            if isinstance(value, dict):
+                mergeCounts(aggregates, field, parts, sizes)
+                continue
+            total = np.zeros((len(aggregates),) + np.shape(value), dtype=np.int64)
+            combine = np.maximum if field in AGGREGATE_MAXIMA else np.add
+            for values, pack_ids in parts:
+                combine.at(total, pack_ids["user"], values)
+            for aggregate, merged in zip(aggregates, total.tolist()):
+                setattr(aggregate, field, merged)
+        setattr(dataset, name, aggregates)
+    for store_name in storeNames(dataset):
+        if packs:
+            setattr(dataset, store_name, packs[0]["stores"][store_name])
+        for pack, pack_ids in zip(packs[1:], ids[1:]):
+            getattr(dataset, store_name).extend(pack["stores"][store_name], pack_ids)
+    return dataset
+
+def mergeDatasets(datasets, sketch=False):
+    return mergePacks([packDataset(dataset) for dataset in datasets], sketch)
+
 # ---------------------------------------------------------------------------------
 #       HELPER FUNCTIONS
 
@@ -140,357 +633,2198 @@ def secondsToFormattedTime(time):
     time -= minutes * 60
     return (str(int(hours)) + ":" + str(int(minutes)) + ":" + str(int(time)))
 
-def removeOutliers(data):
-    data.sort()
-    upper = []
-    lower = []
-    if len(data) % 2 == 0:
-        lower = data[:int(len(data) / 2)]
-        upper = data[int(len(data) / 2):]
-    else:
-        lower = data[:int(len(data) / 2)]
-        upper = data[int(len(data) / 2) + 1:]
-    q1 = statistics.median(lower)
-    q3 = statistics.median(upper)
-    iqr = q3-q1
-    lower = q1 - (iqr * 1.5)
-    upper = q3 + (iqr * 1.5)
-    ret_val = []
-    for d in data:
-        if d >= lower and d <= upper:
-            ret_val.append(d)
-    return ret_val
-    
-# data is a list of integers
-def normalize_list(data):
-    _max = max(data)
-    _min = min(data)
-    ret_val = []
-    for d in data:
-        ret_val.append((d - _min) / (_max - _min))
-    return ret_val
-    
 # data is a list of lists; normalize based on position in the second list
 # so if you have [a1,b1,c1] and [a2,b2,c2] where a, b, c are attributes,
-# all a's, b's and c's will be normalized seperately
+# all a's, b's and c's will be normalized seperately. A column with one value
+# throughout (e.g. every user without emails at 0) is left at 0
 def normalize(data):
-    for i in range(len(data[0])):
-        values = []
-        for j in range(len(data)):
-            values.append(data[j][i])
-        values = normalize_list(values)
-        for j in range(len(data)):
-            data[j][i] = values[j]
-    return data
-    
-def distance(ref, values):
-    if len(ref) != len(values):
-        return -1
-    _sum = 0
-    for i in range(len(values)):
-        _sum += (ref[i] - values[i])**2
-    return math.sqrt(_sum)
-    
-    
-def centroid(points):
-    point = []
-    for i in range(len(points[0])):
-        val = 0
-        for j in range(len(points)):
-            val += points[j][i]
-        point.append(val / len(points))
-    return point
-
-# points are what we are trying to cluster, ref_points are what we are using as the starting centroids
-def k_meansCluster(points, ref_points):
-    num_groups = len(ref_points)
-    groups = []
-    for i in range(num_groups):
-        groups.append([])
-        groups[i].append(ref_points[i])
-    for p in points:
-        closest = ref_points[0]
-        for ref in ref_points:
-            if distance(ref, p) < distance(closest, p):
-                closest = ref
-        for g in groups:
-            if g[0] == closest:
-                g.append(p)
-    for g in groups:
-        if len(g) > 1:
-            g[0] = centroid(g[1:])
-    return groups
-def k_meansClusterFull(refs, points):
-    res = k_meansCluster(points, refs)
-    new_refs = []
-    for i in range(len(res)):
-        new_refs.append(res[i][0])
-    while refs != new_refs:
-        res = k_meansCluster(points, new_refs)
-        refs = new_refs
-        new_refs = []
-        for i in range(len(res)):
-            new_refs.append(res[i][0])
+    data = np.asarray(data, dtype=float)
+    low = data.min(axis=0)
+    span = data.max(axis=0) - low
+    span[span == 0] = 1
+    return (data - low) / span
     
-    # res now has the groups with the centroids
+KMEANS_TOL = 1e-4 # relative to the data's variance, like sklearn
+KMEANS_MAX_ITER = 300
+KMEANS_BLOCK_ROWS = 65536 # rows per block of the distance matrix, bounds memory
+
+# squared euclidean distance from every point to every centroid, shape (points, centroids).
+# uses |p|^2 - 2 p.c + |c|^2 so the work is one matrix product per block
+def pairwiseDistances(points, centroids, point_norms=None):
+    if point_norms is None:
+        point_norms = (points ** 2).sum(axis=1)
+    ret_val = np.empty((len(points), len(centroids)))
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    for s in range(0, len(points), KMEANS_BLOCK_ROWS):
+        block = points[s:s + KMEANS_BLOCK_ROWS]
+        d = block @ (-2 * centroids.T)
+        d += point_norms[s:s + len(block), None]
+        d += centroid_norms[None, :]
+        ret_val[s:s + len(block)] = np.maximum(d, 0)
+    return ret_val
+
+# k-means++ seeding: each new centroid is a point picked with probability
+# proportional to its squared distance from the closest centroid so far
+def kMeansPlusPlus(points, k, rng):
+    centroids = [points[rng.integers(len(points))]]
+    closest = pairwiseDistances(points, np.array(centroids))[:, 0]
+    for i in range(1, k):
+        total = closest.sum()
+        if total == 0:
+            idx = rng.integers(len(points))
+        else:
+            idx = rng.choice(len(points), p=closest / total)
+        centroids.append(points[idx])
+        closest = np.minimum(closest, pairwiseDistances(points, points[idx:idx + 1])[:, 0])
+    return np.array(centroids, dtype=float)
+
+# points are what we are trying to cluster. refs are the starting centroids; when
+# not given, k of them are picked with k-means++. A centroid that loses all of its
+# points stays where it is. Stops once the squared distance all centroids move in an
+# iteration is at most tol times the mean variance of the features, so the same tol
+# fits data of any scale, or once no point changes group.
+# returns (labels, centroids) where labels[i] is the group of points[i]
+def kMeans(points, refs=None, k=None, tol=KMEANS_TOL, max_iter=KMEANS_MAX_ITER, seed=None):
+    points = np.asarray(points, dtype=float)
+    if refs is None:
+        centroids = kMeansPlusPlus(points, k, np.random.default_rng(seed))
+    else:
+        centroids = np.array(refs, dtype=float)
+    k = len(centroids)
+    point_norms = (points ** 2).sum(axis=1)
+    columns = np.ascontiguousarray(points.T) # one contiguous array per feature for bincount
+    tol = tol * points.var(axis=0).mean() if len(points) else 0
+    labels = None
+    for it in range(max_iter):
+        previous = labels
+        labels = np.argmin(pairwiseDistances(points, centroids, point_norms), axis=1)
+        if previous is not None and np.array_equal(labels, previous):
+            break # the centroids would not move
+        counts = np.bincount(labels, minlength=k)
+        filled = counts > 0
+        new_centroids = centroids.copy()
+        for j in range(len(columns)):
+            sums = np.bincount(labels, weights=columns[j], minlength=k)
+            new_centroids[filled, j] = sums[filled] / counts[filled]
+        shift = ((new_centroids - centroids) ** 2).sum()
+        centroids = new_centroids
+        if shift <= tol:
+            break
+    labels = np.argmin(pairwiseDistances(points, centroids, point_norms), axis=1)
+    return labels, centroids
+
+# ---- k sweep
+# k-means is run for every k with several k-means++ starts, each from its own seed
+# derived from (seed, k, restart), so a sweep gives the same models however many
+# processes it runs on. The run with the lowest inertia is kept for each k, and the k
+# whose model has the highest silhouette is recommended
+
+KMEANS_RESTARTS = 10
+KMEANS_WORKERS = os.cpu_count() or 1
+SWEEP_MIN_WORK = 1 << 18 # points * runs below which a process pool costs more than it saves
+SILHOUETTE_SAMPLE = 2000 # silhouette is averaged over at most this many points
+SILHOUETTE_BLOCK = 1 << 22 # distances held at once while scoring
+
+# sum of squared distances from each point to its centroid
+def inertia(points, labels, centroids):
+    return float(((points - centroids[labels]) ** 2).sum())
+
+# mean silhouette width over a seeded sample of the points. A point alone in its
+# group scores 0, as do all points when there are fewer than 2 groups
+def silhouette(points, labels, k, sample=SILHOUETTE_SAMPLE, seed=0):
+    points = np.asarray(points, dtype=float)
+    n = len(points)
+    counts = np.bincount(labels, minlength=k)
+    if np.count_nonzero(counts) < 2:
+        return 0.0
+    if n > sample:
+        idx = np.sort(np.random.default_rng(seed).choice(n, sample, replace=False))
+    else:
+        idx = np.arange(n)
+    members = np.zeros((n, k))
+    members[np.arange(n), labels] = 1
+    sums = np.empty((len(idx), k))
+    rows = max(1, SILHOUETTE_BLOCK // n)
+    norms = (points ** 2).sum(axis=1)
+    for s in range(0, len(idx), rows):
+        block = idx[s:s + rows]
+        sums[s:s + len(block)] = np.sqrt(pairwiseDistances(points[block], points, norms[block])) @ members
+    own = labels[idx]
+    rows = np.arange(len(idx))
+    a = sums[rows, own] / np.maximum(counts[own] - 1, 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        other = np.where(counts > 0, sums / counts, np.inf)
+    other[rows, own] = np.inf
+    b = other.min(axis=1)
+    widest = np.maximum(a, b)
+    scores = np.zeros(len(idx))
+    scored = (counts[own] > 1) & (widest > 0)
+    scores[scored] = (b[scored] - a[scored]) / widest[scored]
+    return float(scores.mean())
+
+SWEEP_POINTS = None # the points of a sweep, set once per worker process
+
+def setSweepPoints(points):
+    global SWEEP_POINTS
+    SWEEP_POINTS = points
+
+# one k-means run of a sweep: (k, starting centroids or None, seed)
+def sweepRun(task):
+    k, seed = task
+    labels, centroids = kMeans(SWEEP_POINTS, None, k, seed=seed)
+    return labels, centroids, inertia(SWEEP_POINTS, labels, centroids)
+
+# runs k-means for every k in ks, restarts times each from k-means++. Returns (models,
+# recommended k) where models maps k to {"labels", "centroids", "inertia", "silhouette"}
+def kMeansSweep(points, ks=range(2, 6), restarts=KMEANS_RESTARTS, seed=0, workers=KMEANS_WORKERS):
+    points = np.asarray(points, dtype=float)
+    tasks = []
+    for k in ks:
+        for r in range(restarts):
+            tasks.append((k, [seed, k, r]))
+    if workers > 1 and len(points) * len(tasks) >= SWEEP_MIN_WORK:
+        with multiprocessing.Pool(min(workers, len(tasks)), setSweepPoints, (points,)) as pool:
+            results = pool.map(sweepRun, tasks)
+    else:
+        setSweepPoints(points)
+        results = [sweepRun(task) for task in tasks]
+        setSweepPoints(None)
+    models = {}
+    for task, (labels, centroids, score) in zip(tasks, results):
+        k = task[0]
+        if k not in models or score < models[k]["inertia"]:
+            models[k] = {"labels": labels, "centroids": centroids, "inertia": score}
+    recommended = None
+    for k in models:
+        models[k]["silhouette"] = silhouette(points, models[k]["labels"], k, seed=seed)
+        if recommended is None or models[k]["silhouette"] > models[recommended]["silhouette"]:
+            recommended = k
+    return models, recommended
+
+# ---- mini-batch k-means
+# for points that do not fit in memory at once, e.g. every login session. Batches
+# come in one after another; each point moves its nearest centroid towards it by
+# 1 / (points that centroid has had so far), so a centroid is the mean of what was
+# assigned to it (Sculley, web-scale k-means). Features are scaled to [0, 1] with the
+# min and max of the first batch. A small random share of every batch is held out
+# (up to MINIBATCH_HOLDOUT_ROWS, by reservoir sampling) and never trained on; the
+# mean squared distance of the held out points is the score, and updating stops
+# once it has not improved by tol for patience batches
+
+MINIBATCH_ROWS = 4096
+MINIBATCH_HOLDOUT = 0.02 # share of each batch held out
+MINIBATCH_HOLDOUT_ROWS = 10000
+MINIBATCH_TOL = 1e-4
+MINIBATCH_PATIENCE = 10
+
+class MiniBatchKMeans:
+    def __init__(self, k, seed=0, tol=MINIBATCH_TOL, patience=MINIBATCH_PATIENCE):
+        self.k = k
+        self.rng = np.random.default_rng(seed)
+        self.tol = tol
+        self.patience = patience
+        self.low = None
+        self.span = None
+        self.centroids = None
+        self.counts = np.zeros(k)
+        self.pending = [] # scaled rows waiting for there to be k of them
+        self.holdout = None
+        self.held = 0 # rows ever offered to the holdout
+        self.history = [] # holdout score after each batch
+        self.converged = False
+        self.rows = 0
+
+    def scale(self, points):
+        return (np.asarray(points, dtype=float) - self.low) / self.span
+
+    def addHoldout(self, points):
+        if self.holdout is None:
+            self.holdout = np.empty((0, points.shape[1]))
+        room = MINIBATCH_HOLDOUT_ROWS - len(self.holdout)
+        if room > 0:
+            self.holdout = np.concatenate([self.holdout, points[:room]])
+            self.held += min(room, len(points))
+            points = points[room:]
+        # reservoir sampling for the rest: the i-th row offered replaces a random row
+        # with probability MINIBATCH_HOLDOUT_ROWS / i
+        for row in points:
+            self.held += 1
+            j = self.rng.integers(self.held)
+            if j < MINIBATCH_HOLDOUT_ROWS:
+                self.holdout[j] = row
+
+    def score(self):
+        if self.holdout is None or len(self.holdout) == 0 or self.centroids is None:
+            return None
+        return float(pairwiseDistances(self.holdout, self.centroids).min(axis=1).mean())
+
+    # one batch of raw (unscaled) feature rows
+    def update(self, batch):
+        batch = np.asarray(batch, dtype=float)
+        if len(batch) == 0:
+            return
+        if self.low is None:
+            self.low = batch.min(axis=0)
+            self.span = batch.max(axis=0) - self.low
+            self.span[self.span == 0] = 1
+        points = self.scale(batch)
+        held = self.rng.random(len(points)) < MINIBATCH_HOLDOUT
+        if held.any():
+            self.addHoldout(points[held])
+        points = points[~held]
+        if self.centroids is None:
+            self.pending.append(points)
+            points = np.concatenate(self.pending)
+            if len(points) < self.k:
+                return
+            self.pending = []
+            self.centroids = kMeansPlusPlus(points, self.k, self.rng)
+        if self.converged or len(points) == 0:
+            return
+        self.rows += len(points)
+        labels = np.argmin(pairwiseDistances(points, self.centroids), axis=1)
+        counts = np.bincount(labels, minlength=self.k)
+        self.counts += counts
+        filled = counts > 0
+        for j in range(points.shape[1]):
+            means = np.bincount(labels, weights=points[:, j], minlength=self.k)[filled] / counts[filled]
+            self.centroids[filled, j] += counts[filled] / self.counts[filled] * (means - self.centroids[filled, j])
+        score = self.score()
+        if score is not None:
+            self.history.append(score)
+            if len(self.history) > self.patience:
+                best_before = min(self.history[:-self.patience])
+                if min(self.history[-self.patience:]) > best_before * (1 - self.tol):
+                    self.converged = True
+
+    # group of each raw feature row
+    def predict(self, batch):
+        return np.argmin(pairwiseDistances(self.scale(batch), self.centroids), axis=1)
+
+SESSION_FEATURES = ["duration", "login", "ave_proc", "max_proc", "chars_typed", "cpu"]
+
+# (user ids, session features) a block at a time from a login ColumnStore. The login
+# feature is the time of day
+def sessionBatches(logins, rows=MINIBATCH_ROWS):
+    for block in logins.blocks(["user"] + SESSION_FEATURES, rows):
+        block[2] = secondsOfDay(block[2])
+        yield block[0], np.column_stack(block[1:])
+
+# the same straight from the log, without keeping anything but the current batch;
+# user names go through the users Interner
+def streamSessionBatches(path, users, rows=MINIBATCH_ROWS):
+    ids = []
+    features = []
+    for rtype, rec in decodeRecords(logRecords(path, "1")):
+        uid, machine, start_time, end_time, num_proc, max_proc, chars_typed, cpu_use = rec
+        ids.append(users.intern(uid))
+        features.append((end_time - start_time, start_time % 86400, num_proc, max_proc, chars_typed, cpu_use))
+        if len(ids) == rows:
+            yield np.array(ids), np.array(features, dtype=float)
+            ids = []
+            features = []
+    if ids:
+        yield np.array(ids), np.array(features, dtype=float)
+
+# fits k groups over batches() (a function returning a fresh batch iterator, it is
+# gone through twice) and puts each user in the group most of their sessions are
+# in. Returns (model, label per user id, -1 for users without sessions)
+def clusterSessions(batches, k, num_users, seed=0):
+    model = MiniBatchKMeans(k, seed)
+    for ids, features in batches():
+        model.update(features)
+    votes = np.zeros((num_users, k), dtype=np.int64)
+    for ids, features in batches():
+        np.add.at(votes, (ids, model.predict(features)), 1)
+    labels = np.argmax(votes, axis=1)
+    labels[votes.sum(axis=1) == 0] = -1
+    return model, labels
+
+# labels -> list of groups of user names, names[i] is the name of the i-th point
+def labelsToGroups(labels, k, names):
     groups = []
-    for i in range(len(refs)):
+    for i in range(k):
         groups.append([])
-    for i in range(len(points)):
-        for j in range(len(groups)):
-            if points[i] in res[j]:
-                groups[j].append("U" + str(i + 1))
+    for i in range(len(labels)):
+        groups[labels[i]].append(names[i])
     return groups
-    
-def rm_dup(lst):
-    res = []
-    [res.append(x) for x in lst if x not in res]
-    return res
-    
+
+# logins per (user, machine), sparse: only the pairs that occur are kept, as
+# (row, column, count) sorted by row and then column. Rows are users and columns
+# machines, both by name. Rows and columns can be looked up by name in either direction
+class MachineMatrix:
+    def __init__(self, users, machines, rows, columns, counts):
+        self.users = users # row names
+        self.machines = machines # column names
+        self.rows = rows
+        self.columns = columns
+        self.counts = counts
+        self.row_starts = np.searchsorted(rows, np.arange(len(users) + 1))
+        self.by_column = np.argsort(columns, kind="stable")
+        self.column_starts = np.searchsorted(columns[self.by_column], np.arange(len(machines) + 1))
+        self.row_of = {name: i for i, name in enumerate(users)}
+        self.column_of = {name: i for i, name in enumerate(machines)}
+
+    def __len__(self):
+        return len(self.counts)
+
+    # {user: logins} for one machine, e.g. which users touched M17
+    def usersOf(self, machine):
+        if machine not in self.column_of:
+            return {}
+        j = self.column_of[machine]
+        idx = self.by_column[self.column_starts[j]:self.column_starts[j + 1]]
+        return dict(zip([self.users[r] for r in self.rows[idx].tolist()], self.counts[idx].tolist()))
+
+    # row i with a 0 for every machine the user never used
+    def denseRow(self, i):
+        row = np.zeros(len(self.machines), dtype=np.int64)
+        span = slice(self.row_starts[i], self.row_starts[i + 1])
+        row[self.columns[span]] = self.counts[span]
+        return row
+
+    # in the layout of Machine_type_one_matrix.csv: a User,M01,M02,... header then one
+    # line per user. Rows are made one at a time, so only one is ever dense
+    def writeCsv(self, path):
+        with open(path, "w") as file:
+            file.write(",".join(["User"] + self.machines) + "\n")
+            for i in range(len(self.users)):
+                file.write(self.users[i] + "," + ",".join(map(str, self.denseRow(i).tolist())) + "\n")
+
+MACHINE_MATRIX_DENSE_CELLS = 1 << 24 # above this many cells pairs are counted with np.unique
+
+# MachineMatrix of the users in order (dataset ids) and the machines logged in to, by
+# name; machines (a list of names) puts those columns first, used or not, so a fixed
+# layout such as M01..M30 can be kept. Only login records count, so the columns do not
+# depend on which other record types were parsed. Counted in one pass over the login
+# user and machine columns; sketch mode keeps no columns, so there it comes from the
+# per user machine counts
+def machineMatrix(dataset, order, machines=None):
+    if isinstance(dataset.logins, ColumnStore):
+        used = np.unique(dataset.logins.column("machine")).tolist()
+    else:
+        used = set()
+        for user in dataset.type_one_users:
+            used.update(user.machines)
+    names = byName([dataset.machines.names[m] for m in used])
+    if machines is not None:
+        given = set(machines)
+        names = list(machines) + [name for name in names if name not in given]
+    column_of = np.zeros(len(dataset.machines), dtype=np.int64)
+    for j, name in enumerate(names):
+        if name in dataset.machines.ids:
+            column_of[dataset.machines.ids[name]] = j
+    row_of = np.zeros(len(dataset.users), dtype=np.int64)
+    row_of[order] = np.arange(len(order))
+    num_columns = max(len(names), 1)
+    if isinstance(dataset.logins, ColumnStore):
+        keys = row_of[dataset.logins.column("user")] * num_columns + column_of[dataset.logins.column("machine")]
+        if len(order) * num_columns <= MACHINE_MATRIX_DENSE_CELLS:
+            counts = np.bincount(keys, minlength=len(order) * num_columns)
+            keys = np.flatnonzero(counts)
+            counts = counts[keys]
+        else:
+            keys, counts = np.unique(keys, return_counts=True)
+    else:
+        keys = []
+        counts = []
+        for uid in order:
+            for machine, count in dataset.type_one_users[uid].machines.items():
+                keys.append(row_of[uid] * num_columns + column_of[machine])
+                counts.append(count)
+        keys = np.array(keys, dtype=np.int64)
+        counts = np.array(counts, dtype=np.int64)
+        sort = np.argsort(keys)
+        keys = keys[sort]
+        counts = counts[sort]
+    return MachineMatrix([dataset.users.names[u] for u in order], names, keys // num_columns, keys % num_columns,
+    counts.astype(np.int64))
+
+# machine names from a comma separated list where a range such as M01-M30 stands for
+# every name in it, zero padded like its first name
+def machineNames(spec):
+    names = []
+    for part in spec.split(","):
+        part = part.strip()
+        first, dash, last = part.partition("-")
+        if dash and naturalKey(first)[1] and naturalKey(last)[1]:
+            prefix = naturalKey(first)[0]
+            width = len(first) - len(prefix)
+            names.extend(prefix + str(i).zfill(width) for i in range(naturalKey(first)[1], naturalKey(last)[1] + 1))
+        elif part:
+            names.append(part)
+    return names
+
 # ---------------------------------------------------------------------------------
-    
-def main():
-    # file = open("sorted-proj-data.csv")
-    file = open("sorted-proj-data.csv")
-    lines = file.readlines()
-    
-    type_one_users = []
-    resources = []
-    emails = []
-    for i in range(1, 10):
-        type_one_users.append(User("U0"+str(i)))
-        resources.append(Resource("U0"+str(i)))
-        emails.append(Email("U0"+str(i)))
-    for i in range(10, 20):
-        type_one_users.append(User("U"+str(i)))
-        resources.append(Resource("U"+str(i)))
-        emails.append(Email("U"+str(i)))
+#       EMAIL GRAPH
+#       who mails whom: one edge per (user, address, direction) with the number of
+#       messages, their bytes and attachments summed. Edges are kept sorted by user,
+#       then address, then direction (compressed rows), with an index by address.
+#       Users and addresses are the Dataset's own interned ids, which a cached log
+#       keeps from run to run
 
-    
+EMAIL_GRAPH_TOP = 10 # heaviest edges the email-graph section lists
 
-    
+class EmailGraph:
+    def __init__(self, users, addresses, directions, rows, columns, direction, messages, bytes, attachments):
+        self.users = users # Interner, rows
+        self.addresses = addresses # Interner, columns
+        self.directions = directions # Interner of S/R
+        self.rows = rows
+        self.columns = columns
+        self.direction = direction
+        self.messages = messages
+        self.bytes = bytes # nan in sketch mode, which keeps no sizes per address
+        self.attachments = attachments
+        self.row_starts = np.searchsorted(rows, np.arange(len(users) + 1))
+        self.by_column = np.argsort(columns, kind="stable")
+        self.column_starts = np.searchsorted(columns[self.by_column], np.arange(len(addresses) + 1))
+
+    def __len__(self):
+        return len(self.messages)
+
+    # edges of one direction ("S" or "R"), or all of them for None
+    def edgeMask(self, direction):
+        if direction is None:
+            return np.ones(len(self.rows), dtype=bool)
+        return self.direction == self.directions.ids.get(direction, -1)
+
+    # {address: messages} for one user, both directions added up unless one is given
+    def contactsOf(self, user, direction=None):
+        if user not in self.users.ids:
+            return {}
+        i = self.users.ids[user]
+        span = slice(self.row_starts[i], self.row_starts[i + 1])
+        keep = self.edgeMask(direction)[span]
+        columns, counts = sumByKey(self.columns[span][keep], self.messages[span][keep])
+        return dict(zip([self.addresses.names[c] for c in columns.tolist()], counts.astype(np.int64).tolist()))
+
+    # {user: messages} for one address
+    def usersOf(self, address, direction=None):
+        if address not in self.addresses.ids:
+            return {}
+        j = self.addresses.ids[address]
+        idx = self.by_column[self.column_starts[j]:self.column_starts[j + 1]]
+        idx = idx[self.edgeMask(direction)[idx]]
+        rows, counts = sumByKey(self.rows[idx], self.messages[idx])
+        return dict(zip([self.users.names[r] for r in rows.tolist()], counts.astype(np.int64).tolist()))
+
+    # (rows, columns) of every distinct user, address pair, sorted by user then address.
+    # Edges already are, so only the direction has to be folded away
+    def pairs(self, direction=None):
+        keep = self.edgeMask(direction)
+        rows = self.rows[keep]
+        columns = self.columns[keep]
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = (rows[1:] != rows[:-1]) | (columns[1:] != columns[:-1])
+        return rows[first], columns[first]
+
+    # number of distinct addresses of every user, indexed by user id
+    def contactCounts(self, direction=None):
+        rows, columns = self.pairs(direction)
+        return np.bincount(rows, minlength=len(self.users))
+
+    # (left, right, shared addresses) for every ordered pair of different users with at
+    # least min_shared addresses in common, sorted by left then right. Only users that
+    # share an address are paired, a block at a time like similarPairs
+    def sharedContactPairs(self, min_shared=1, direction=None):
+        n = max(len(self.users), 1)
+        rows, columns = self.pairs(direction)
+        by_column = np.argsort(columns, kind="stable")
+        left, right, sums = sumPairs(sharedBlocks(rows[by_column], columns[by_column], np.ones(len(rows), dtype=np.int64)), n)
+        keep = sums >= min_shared
+        return left[keep], right[keep], sums[keep].astype(np.int64)
+
+    # connected components of the user - address graph, as (component of every user id,
+    # component of every address id). Components are numbered by their lowest user id
+    # (addresses nobody in the log mails come after). Roots are hooked under the lower
+    # root of every edge and then every node is pointed at its root, until no edge
+    # joins two roots; the number of rounds grows with the log of the diameter
+    def components(self):
+        n = len(self.users)
+        parent = np.arange(n + len(self.addresses))
+        left = self.rows.astype(np.int64)
+        right = self.columns.astype(np.int64) + n
+        while True:
+            a = parent[left]
+            b = parent[right]
+            differ = a != b
+            if not differ.any():
+                break
+            np.minimum.at(parent, np.maximum(a, b)[differ], np.minimum(a, b)[differ])
+            while True:
+                jumped = parent[parent]
+                if np.array_equal(jumped, parent):
+                    break
+                parent = jumped
+        labels = np.unique(parent, return_inverse=True)[1].ravel()
+        return labels[:n], labels[n:]
+
+    # the n heaviest edges by weight ("messages", "bytes" or "attachments"), heaviest
+    # first, as (user, address, direction, messages, bytes, attachments). Edges that tie
+    # go by user, address and direction name, so the answer does not depend on the log's order
+    def heaviestEdges(self, n, weight="bytes"):
+        weights = np.nan_to_num(getattr(self, weight), nan=-1)
+        if n <= 0 or len(weights) == 0:
+            return []
+        lightest = np.partition(weights, len(weights) - min(n, len(weights)))[len(weights) - min(n, len(weights))]
+        top = np.flatnonzero(weights >= lightest)
+        top = top[np.lexsort((nameRanks(self.directions.names)[self.direction[top]],
+        nameRanks(self.addresses.names)[self.columns[top]], nameRanks(self.users.names)[self.rows[top]], -weights[top]))][:n]
+        return [(self.users.names[self.rows[e]], self.addresses.names[self.columns[e]], self.directions.names[self.direction[e]],
+        int(self.messages[e]), self.bytes[e].item(), self.attachments[e].item()) for e in top.tolist()]
+
+# position of every name when the names are sorted by naturalKey, indexed by id
+def nameRanks(names):
+    ranks = np.zeros(len(names), dtype=np.int64)
+    ranks[sorted(range(len(names)), key=lambda i: naturalKey(names[i]))] = np.arange(len(names))
+    return ranks
+
+# the EmailGraph of a dataset: every message grouped by (user, address, direction) in
+# one np.unique over the email columns; sketch mode keeps no columns, so there it
+# comes from the per user address counts
+def emailGraph(dataset):
+    num_addresses = max(len(dataset.addresses), 1)
+    num_directions = max(len(dataset.directions), 1)
+    if isinstance(dataset.messages, ColumnStore):
+        messages = dataset.messages
+        keys = (messages.column("user").astype(np.int64) * num_addresses + messages.column("address")) * num_directions \
+        + messages.column("direction")
+        keys, edges = np.unique(keys, return_inverse=True)
+        edges = edges.ravel()
+        counts = np.bincount(edges, minlength=len(keys))
+        sizes = np.bincount(edges, weights=messages.column("bytes"), minlength=len(keys))
+        attachments = np.bincount(edges, weights=messages.column("attachments"), minlength=len(keys))
+    else:
+        keys = []
+        counts = []
+        for uid in range(len(dataset.users)):
+            for (address, direction), count in dataset.emails[uid].addresses.items():
+                keys.append((uid * num_addresses + address) * num_directions + direction)
+                counts.append(count)
+        keys = np.array(keys, dtype=np.int64)
+        counts = np.array(counts, dtype=np.int64)
+        sort = np.argsort(keys)
+        keys = keys[sort]
+        counts = counts[sort]
+        sizes = np.full(len(keys), np.nan)
+        attachments = np.full(len(keys), np.nan)
+    return EmailGraph(dataset.users, dataset.addresses, dataset.directions, keys // num_directions // num_addresses,
+    keys // num_directions % num_addresses, keys % num_directions, counts.astype(np.int64), sizes, attachments)
+
+# ---------------------------------------------------------------------------------
+#       FILE ACCESS SIMILARITY
+#       similarity of users u and v is the sum over files of min(accesses by u,
+#       accesses by v), divided by the larger number of records of the two
+
+SIMILARITY_BLOCK_PAIRS = 1 << 22 # (entry, entry) pairs expanded at a time
+
+# file_counts is a list of {file: count} dicts, one per user. Returns the sparse
+# user x file count matrix as (users, files, counts) arrays sorted by file
+def fileCountMatrix(file_counts):
+    file_ids = {}
+    users = []
+    files = []
+    counts = []
+    for u in range(len(file_counts)):
+        for f in file_counts[u]:
+            users.append(u)
+            files.append(file_ids.setdefault(f, len(file_ids)))
+            counts.append(file_counts[u][f])
+    users = np.array(users, dtype=np.int64)
+    files = np.array(files, dtype=np.int64)
+    counts = np.array(counts, dtype=np.int64)
+    order = np.argsort(files, kind="stable")
+    return users[order], files[order], counts[order]
+
+# yields (left users, right users, mins) for every pair of entries of the user x file
+# matrix that share a file, a block of at most SIMILARITY_BLOCK_PAIRS pairs at a time
+def overlapBlocks(file_counts):
+    return sharedBlocks(*fileCountMatrix(file_counts))
+
+# the same for any sparse (users, keys, counts) matrix given sorted by key, e.g. the
+# user x address matrix of the email graph
+def sharedBlocks(users, files, counts):
+    if len(users) == 0:
+        return
+    file_sizes = np.bincount(files)
+    file_starts = np.cumsum(file_sizes) - file_sizes
+    partners = file_sizes[files] # number of entries sharing each entry's file
+    pair_ends = np.cumsum(partners)
+    block_start = 0
+    while block_start < len(users):
+        done = pair_ends[block_start - 1] if block_start > 0 else 0
+        block_end = max(block_start + 1, np.searchsorted(pair_ends, done + SIMILARITY_BLOCK_PAIRS, side="right"))
+        sizes = partners[block_start:block_end]
+        left = np.repeat(np.arange(block_start, block_end), sizes)
+        right = np.repeat(file_starts[files[block_start:block_end]] - (np.cumsum(sizes) - sizes), sizes) + np.arange(len(left))
+        yield users[left], users[right], np.minimum(counts[left], counts[right])
+        block_start = block_end
+
+# adds up weights with equal keys, returns (keys, sums) with the keys sorted
+def sumByKey(keys, weights):
+    keys, idx = np.unique(keys, return_inverse=True)
+    return keys, np.bincount(idx.ravel(), weights=weights, minlength=len(keys))
+
+# adds up the weights of every pair of different users over blocks of (left, right,
+# weights), returns (left, right, sums) sorted by left then right. Each block is
+# summed on its own and the block sums once at the end, so no key is sorted again
+# for every block
+def sumPairs(blocks, n):
+    keys = [np.zeros(0, dtype=np.int64)]
+    sums = [np.zeros(0)]
+    for left, right, weights in blocks:
+        different = left != right
+        block_keys, block_sums = sumByKey(left[different] * n + right[different], weights[different])
+        keys.append(block_keys)
+        sums.append(block_sums)
+    keys, sums = sumByKey(np.concatenate(keys), np.concatenate(sums))
+    return keys // n, keys % n, sums
+
+# file similarity between users: (left, right, similarity) for every ordered pair of
+# different users above threshold, sorted by left then right. Similarity is the sum
+# over files of min(count u, count v), divided by the larger record count. Only pairs
+# of users that share a file are ever looked at, so this works where U x U does not fit
+def similarPairs(file_counts, num_records, threshold):
+    n = len(file_counts)
+    num_records = np.array(num_records, dtype=float)
+    left, right, sums = sumPairs(overlapBlocks(file_counts), max(n, 1))
+    similarity = sums / np.maximum(num_records[left], num_records[right])
+    above = similarity > threshold
+    return left[above], right[above], similarity[above]
+
+# user v is a superset of user u when v accessed every file:permission u did, the
+# same number of times. Returns, for every user, the sorted list of the other users
+# that are supersets of it. Uses an inverted index from (file, count) to the users
+# with that many accesses; the posting lists of a user's entries are intersected
+# smallest first, so most candidates drop out after the first list
+def fileSupersets(file_counts):
+    postings = {}
+    for u in range(len(file_counts)):
+        for entry in file_counts[u].items():
+            postings.setdefault(entry, []).append(u)
+    everyone = list(range(len(file_counts)))
+    supersets = []
+    for u in range(len(file_counts)):
+        lists = sorted((postings[entry] for entry in file_counts[u].items()), key=len)
+        candidates = set(lists[0]) if lists else set(everyone)
+        for posting in lists[1:]:
+            if len(candidates) == 1:
+                break # only u itself is left, it is in all of its own lists
+            candidates.intersection_update(posting)
+        candidates.discard(u)
+        supersets.append(sorted(candidates))
+    return supersets
+
+# ---- approximate similar pairs with MinHash + LSH
+# each user's file:permission counts become a set of (file, 1), ..., (file, count)
+# elements, so plain MinHash on it estimates the weighted Jaccard similarity
+# J = sum(min) / sum(max). A pair with similarity > t (where every record of a user
+# is one file access or fewer) has J > t / (2 - t), so LSH bands tuned for that J
+# find it with the requested probability. Candidates are then checked exactly
+
+MINHASH_PERMUTATIONS = 128
+
+def mix64(x):
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xbf58476d1ce4e5b9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+# num_perm minimum hashes per user, shape (users, num_perm). Users with no files
+# get all ones
+def minHashSignatures(file_counts, num_perm=MINHASH_PERMUTATIONS, seed=0):
+    n = len(file_counts)
+    users, files, counts = fileCountMatrix(file_counts)
+    signatures = np.full((n, num_perm), np.iinfo(np.uint64).max, dtype=np.uint64)
+    if len(users) == 0:
+        return signatures
+    # one element per single access
+    entry = np.repeat(np.arange(len(users)), counts)
+    copy_no = np.arange(len(entry)) - np.repeat(np.cumsum(counts) - counts, counts)
+    element_users = users[entry]
+    elements = (files[entry] * (counts.max() + 1) + copy_no).astype(np.uint64)
+    order = np.argsort(element_users, kind="stable")
+    element_users = element_users[order]
+    elements = elements[order]
+    starts = np.flatnonzero(np.r_[True, element_users[1:] != element_users[:-1]])
+    seeds = mix64(np.arange(num_perm, dtype=np.uint64) + np.uint64(seed * num_perm + 1))
+    with np.errstate(over="ignore"):
+        for k in range(num_perm):
+            signatures[element_users[starts], k] = np.minimum.reduceat(mix64(elements ^ seeds[k]), starts)
+    return signatures
+
+# (bands, rows) with bands * rows <= num_perm and the fewest false candidates such
+# that a pair with Jaccard similarity jaccard is a candidate with probability >= recall
+def lshBands(num_perm, jaccard, recall):
+    for rows in range(num_perm, 0, -1):
+        bands = num_perm // rows
+        if 1 - (1 - jaccard ** rows) ** bands >= recall:
+            return bands, rows
+    return num_perm, 1
+
+# pairs (left < right) of users whose signatures agree on all rows of some band
+def lshCandidates(signatures, bands, rows):
+    n = len(signatures)
+    empty = (signatures == np.iinfo(np.uint64).max).all(axis=1)
+    keys = []
+    with np.errstate(over="ignore"):
+        for b in range(bands):
+            bucket = np.zeros(n, dtype=np.uint64)
+            for r in range(b * rows, (b + 1) * rows):
+                bucket = mix64(bucket ^ signatures[:, r])
+            members = np.flatnonzero(~empty)
+            members = members[np.argsort(bucket[members], kind="stable")]
+            sorted_buckets = bucket[members]
+            starts = np.flatnonzero(np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1]])
+            sizes = np.diff(np.r_[starts, len(members)])
+            # every pair inside every bucket of two or more users
+            keep = sizes > 1
+            starts = starts[keep]
+            sizes = sizes[keep]
+            position = np.repeat(starts, sizes) + np.arange(int(sizes.sum())) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+            partners = np.repeat(sizes, sizes)
+            left = np.repeat(position, partners)
+            right = np.repeat(np.repeat(starts, sizes) - (np.cumsum(partners) - partners), partners) + np.arange(len(left))
+            left = members[left]
+            right = members[right]
+            keys.append(left[left < right] * n + right[left < right])
+    if not keys:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    keys = np.unique(np.concatenate(keys))
+    return keys // n, keys % n
+
+# approximate similarPairs: same result except that a pair above threshold is missed
+# with probability about 1 - recall
+def approxSimilarPairs(file_counts, num_records, threshold, recall=0.95, num_perm=MINHASH_PERMUTATIONS, seed=0):
+    bands, rows = lshBands(num_perm, threshold / (2 - threshold), recall)
+    candidates_left, candidates_right = lshCandidates(minHashSignatures(file_counts, num_perm, seed), bands, rows)
+    left = []
+    right = []
+    similarity = []
+    for u, v in zip(candidates_left.tolist(), candidates_right.tolist()):
+        small, large = file_counts[u], file_counts[v]
+        if len(small) > len(large):
+            small, large = large, small
+        overlap = 0
+        for f in small:
+            if f in large:
+                overlap += min(small[f], large[f])
+        s = overlap / max(num_records[u], num_records[v])
+        if s > threshold:
+            left += [u, v]
+            right += [v, u]
+            similarity += [s, s]
+    left = np.array(left, dtype=np.int64)
+    right = np.array(right, dtype=np.int64)
+    similarity = np.array(similarity)
+    order = np.lexsort((right, left))
+    return left[order], right[order], similarity[order]
+
+# ---------------------------------------------------------------------------------
+#       INGEST PIPELINE
+#       read -> split -> decode -> aggregate, a record (or a small batch of
+#       records) at a time so the whole log never has to sit in memory
+
+READ_BUFFER_SIZE = 1 << 20 # bytes read from disk at a time
+
+# yields the lines that start in bytes [start, end) of the file
+def readLines(path, buffer_size=READ_BUFFER_SIZE, start=0, end=None):
+    with open(path, "rb", buffering=buffer_size) as file:
+        file.seek(start)
+        pos = start
+        for line in file:
+            if end is not None and pos >= end:
+                break
+            pos += len(line)
+            yield line.decode()
+
+def splitLines(lines):
     for line in lines:
-        parts = line.split(',')
-        if parts[0] == '1':
-            # create a date-time object with the starting and ending times
-            raw_date = parts[3]
-            raw_st = parts[4]
-            raw_et = parts[5]
-            start_time = datetime.datetime(int(raw_date[4:]) + 2000, int(raw_date[0:2]), int(raw_date[2:4]),
-            int(raw_st[0:2]), int(raw_st[2:4]), int(raw_st[4:]))
-            end_time = datetime.datetime(int(raw_date[4:]) + 2000, int(raw_date[0:2]), int(raw_date[2:4]),
-            int(raw_et[0:2]), int(raw_et[2:4]), int(raw_et[4:]))
-            workday_len = end_time - start_time
-            #get other useful info
-            uid = parts[1]
-            machine = parts[2]
-            num_proc = int(parts[6])
-            max_proc = int(parts[7])
-            chars_typed = int(parts[8])
-            cpu_use = int(parts[9])
-            user_idx = int(uid[1:]) - 1
-            user = type_one_users[user_idx]
+        yield line.split(',')
+
+RECORD_TYPES = "123"
+
+# drops lines of record types not in types before they are split or decoded
+def selectTypes(lines, types=RECORD_TYPES):
+    if types == RECORD_TYPES:
+        yield from lines
+        return
+    for line in lines:
+        if line[:1] in types:
+            yield line
+
+# ---- xlsx input
+# the workbook the csv is exported from can be read directly. The sheet's XML is
+# walked a row at a time with iterparse and each row is dropped once it is read, so
+# only the shared string table stays in memory. Rows come out like splitLines() gives
+# them. Excel keeps 090108 as the number 90108, so the fixed width date and time
+# fields get their leading zeros back
+
+XLSX_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+XLSX_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+RECORD_FIELDS = 16
+FIXED_WIDTH_FIELDS = {"1": (3, 4, 5), "2": (3, 4, 6), "3": (3, 4)} # record type -> HHMMSS/MMDDYY fields
+
+def isXlsx(path):
+    return path.lower().endswith(".xlsx")
+
+def xlsxSharedStrings(archive):
+    if "xl/sharedStrings.xml" not in archive.namelist():
+        return []
+    strings = []
+    with archive.open("xl/sharedStrings.xml") as file:
+        for event, elem in ElementTree.iterparse(file):
+            if elem.tag == XLSX_NS + "si":
+                strings.append("".join(t.text or "" for t in elem.iter(XLSX_NS + "t")))
+                elem.clear()
+    return strings
+
+# archive path of the named sheet, or of the first one
+def xlsxSheetPath(archive, sheet=None):
+    workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+    rels = ElementTree.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+    targets = {rel.get("Id"): rel.get("Target") for rel in rels}
+    for elem in workbook.iter(XLSX_NS + "sheet"):
+        if sheet is None or elem.get("name") == sheet:
+            target = targets[elem.get(XLSX_REL_NS + "id")]
+            return target.lstrip("/") if target.startswith("/") else "xl/" + target
+    raise ValueError("no sheet " + str(sheet) + " in workbook")
+
+# "AB12" -> 27
+def cellColumn(ref):
+    column = 0
+    for c in ref:
+        if not c.isalpha():
+            break
+        column = column * 26 + ord(c.upper()) - 64
+    return column - 1
+
+def cellText(cell, strings):
+    kind = cell.get("t")
+    if kind == "inlineStr":
+        return "".join(t.text or "" for t in cell.iter(XLSX_NS + "t"))
+    value = cell.find(XLSX_NS + "v")
+    if value is None or value.text is None:
+        return ""
+    if kind == "s":
+        return strings[int(value.text)]
+    if kind in ("str", "b", "e"):
+        return value.text
+    number = float(value.text)
+    return str(int(number)) if number.is_integer() else value.text
+
+def readXlsxRows(path, sheet=None):
+    with zipfile.ZipFile(path) as archive:
+        strings = xlsxSharedStrings(archive)
+        with archive.open(xlsxSheetPath(archive, sheet)) as file:
+            parent = None
+            for event, elem in ElementTree.iterparse(file, events=("start", "end")):
+                if event == "start":
+                    if elem.tag == XLSX_NS + "sheetData":
+                        parent = elem
+                    continue
+                if elem.tag != XLSX_NS + "row":
+                    continue
+                parts = [""] * RECORD_FIELDS
+                for cell in elem.iter(XLSX_NS + "c"):
+                    column = cellColumn(cell.get("r", ""))
+                    if 0 <= column < RECORD_FIELDS:
+                        parts[column] = cellText(cell, strings)
+                for field in FIXED_WIDTH_FIELDS.get(parts[0], ()):
+                    if parts[field].isdigit():
+                        parts[field] = parts[field].zfill(6)
+                if parent is not None:
+                    parent.clear() # rows already read
+                if parts[0]:
+                    yield parts
+
+# split records of the given types from a csv byte range or from a workbook
+def logRecords(path, types=RECORD_TYPES, start=0, end=None):
+    if isXlsx(path):
+        return (parts for parts in readXlsxRows(path) if parts[0] in types)
+    return splitLines(selectTypes(readLines(path, start=start, end=end), types))
+
+# ---- timestamps
+# every time is kept as integer seconds since 1970-01-01 (no time zone). seconds of
+# day is t % 86400 and the weekday is weekday(t), Monday = 0 like datetime.weekday()
+
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+DAY_NUMBERS = {} # MMDDYY -> days since 1970-01-01, there are only a few hundred dates
+
+# raw_date is MMDDYY
+def dayNumber(raw_date):
+    day = DAY_NUMBERS.get(raw_date)
+    if day is None:
+        day = datetime.date(int(raw_date[4:6]) + 2000, int(raw_date[0:2]), int(raw_date[2:4])).toordinal() - EPOCH_ORDINAL
+        DAY_NUMBERS[raw_date] = day
+    return day
+
+# raw is HHMMSS
+def toSeconds(raw):
+    return int(raw[0:2]) * 3600 + int(raw[2:4]) * 60 + int(raw[4:])
+
+def toEpoch(raw_date, raw_time):
+    return dayNumber(raw_date) * 86400 + toSeconds(raw_time)
+
+def weekday(epoch):
+    return (epoch // 86400 + 3) % 7 # 1970-01-01 was a Thursday
+
+# fixed width MMDDYY / HHMMSS fields as code points, one row per field, with a
+# seventh column so a field that is too long shows. Returns (fields, digits, ok);
+# ok marks the fields that are exactly six characters, all 0-9
+def digitFields(raw):
+    fields = np.asarray(raw, dtype="U7")
+    codes = fields.view(np.uint32).reshape(-1, 7).astype(np.int64) - 48
+    digits = codes[:, :6]
+    ok = ((digits >= 0) & (digits <= 9)).all(axis=1) & (codes[:, 6] == -48)
+    return fields, digits, ok
+
+# bulk version of toEpoch: the fields are turned into digits with one subtraction,
+# each distinct date goes through dayNumber once. Returns (int64 epochs, ok), where
+# ok marks the rows with six digit fields and a real date; other rows get 0
+def decodeTimestamps(raw_dates, raw_times):
+    if len(raw_dates) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+    dates, _, date_ok = digitFields(raw_dates)
+    _, digits, time_ok = digitFields(raw_times)
+    unique_dates, date_idx = np.unique(dates, return_inverse=True)
+    date_idx = date_idx.ravel()
+    days = np.zeros(len(unique_dates), dtype=np.int64)
+    day_ok = np.ones(len(unique_dates), dtype=bool)
+    for i, d in enumerate(unique_dates.tolist()):
+        try:
+            days[i] = dayNumber(d)
+        except ValueError: # not a date, e.g. month 13; date_ok may already rule it out
+            day_ok[i] = False
+    ok = date_ok & time_ok & day_ok[date_idx]
+    seconds = (digits[:, 0] * 10 + digits[:, 1]) * 3600 + (digits[:, 2] * 10 + digits[:, 3]) * 60 + digits[:, 4] * 10 + digits[:, 5]
+    return np.where(ok, days[date_idx] * 86400 + seconds, 0), ok
+
+DECODE_BATCH_ROWS = 4096
+
+# yields (record type, tuple of decoded fields); type 2 records that are neither
+# a print nor a plain file access are dropped. Records are decoded a batch at a
+# time so the timestamps can go through decodeTimestamps together
+def decodeRecords(records, batch_rows=DECODE_BATCH_ROWS):
+    batch = []
+    for parts in records:
+        batch.append(parts)
+        if len(batch) == batch_rows:
+            yield from decodeBatch(batch)
+            batch = []
+    if batch:
+        yield from decodeBatch(batch)
+
+# fields a line needs to be a record; shorter lines (blank lines, headers, a line cut
+# off) are dropped like lines of an unknown type
+RECORD_MIN_FIELDS = 10
+
+# lines that are not records, or whose dates, times or numbers do not decode, are
+# dropped; when dropped is a list they are appended to it
+def decodeBatch(batch, dropped=None):
+    records = []
+    for p in batch:
+        if p[0] in ("1", "2", "3") and len(p) >= RECORD_MIN_FIELDS:
+            records.append(p)
+        elif dropped is not None:
+            dropped.append(p)
+    start_times, start_ok = decodeTimestamps([p[3] for p in records], [p[4] for p in records])
+    # a login also needs its logout; other records check the start time twice
+    end_times, end_ok = decodeTimestamps([p[3] for p in records], [p[5] if p[0] == '1' else p[4] for p in records])
+    for parts, start_time, end_time, ok in zip(records, start_times.tolist(), end_times.tolist(), (start_ok & end_ok).tolist()):
+        if ok:
+            try:
+                rec = decodeFields(parts, start_time, end_time)
+            except ValueError:
+                ok = False
+        if not ok:
+            if dropped is not None:
+                dropped.append(parts)
+            continue
+        if rec is not None:
+            yield int(parts[0]), rec
+
+# the fields of one record after its timestamps; None for a type 2 record that is
+# neither a print nor a plain file access. Raises ValueError for a bad number
+def decodeFields(parts, start_time, end_time):
+    if parts[0] == '1':
+        # uid, machine, login, logout, num_proc, max_proc, chars_typed, cpu_use
+        return (parts[1], parts[2], start_time, end_time,
+        int(parts[6]), int(parts[7]), int(parts[8]), int(parts[9]))
+    elif parts[0] == '2':
+        if "PR" in parts[9] and len(parts) > 10:
+            printer = parts[9]
+            pages = int(parts[10])
+        elif parts[9] == "":
+            printer = None
+            pages = -1
+        else:
+            return None
+        # uid, machine, start_time, duration, program, file, permissions, printer, pages
+        return (parts[1], parts[2], start_time, toSeconds(parts[6]),
+        parts[5], parts[7], parts[8], printer, pages)
+    else:
+        # uid, machine, start_time, program, address, sent_rec, bytes, attachments
+        return (parts[1], parts[2], start_time, parts[5], parts[6],
+        parts[7], int(parts[8]), int(parts[9]))
+
+def aggregate(records, dataset):
+    for rtype, rec in records:
+        if rtype == 1:
+            uid, machine, start_time, end_time, num_proc, max_proc, chars_typed, cpu_use = rec
+            user_idx = dataset.userIndex(uid)
+            machine_idx = dataset.machines.intern(machine)
+            user = dataset.type_one_users[user_idx]
+            duration = end_time - start_time
             user.inc_records()
-            user.inc_total_time((end_time - start_time).total_seconds())
+            user.inc_total_time(duration)
             user.inc_ave_proc(num_proc)
             user.inc_max_proc(max_proc)
-            user.add_machine(machine)
+            user.add_machine(machine_idx)
             user.add_login(start_time)
-            user.add_logout(end_time)
             user.inc_chars_typed(chars_typed)
             user.inc_cpu(cpu_use)
-        elif parts[0] == '2':
-            if "PR" in parts[9]:
-                uid = parts[1]
-                machine = parts[2]
-                raw_date = parts[3]
-                raw_st = parts[4]
-                program = parts[5]
-                raw_duration = parts[6]
-                fle = parts[7]
-                permissions = parts[8]
-                printer = parts[9]
-                pages = parts[10]
-                start_time = datetime.datetime(int(raw_date[4:]) + 2000, int(raw_date[0:2]), int(raw_date[2:4]),
-                int(raw_st[0:2]), int(raw_st[2:4]), int(raw_st[4:]))
-                d_hours = raw_duration[0:2]
-                d_min = raw_duration[2:4]
-                d_sec = raw_duration[4:]
-                total_dur_seconds = d_hours * 3600 + d_min * 60 + d_sec
-
-                usr_idx = int(uid[1:]) - 1
-                resource = resources[usr_idx]
-                resource.incNumRecord()
+            dataset.logins.append((user_idx, machine_idx, duration, num_proc, max_proc, chars_typed, cpu_use,
+            start_time, end_time))
+        elif rtype == 2:
+            uid, machine, start_time, duration, program, fle, permissions, printer, pages = rec
+            user_idx = dataset.userIndex(uid)
+            machine_idx = dataset.machines.intern(machine)
+            resource = dataset.resources[user_idx]
+            resource.incNumRecord()
+            if printer is not None:
                 resource.incNumPrintRecord()
-                resource.addMachine(machine)
-                resource.addStartTime(start_time)
-                resource.addDuration(total_dur_seconds)
-                resource.addProgram(program)
-                resource.addFile(fle + ":" + permissions)
-                resource.addPrinter(printer + ":" + pages)
-                
-            elif parts[9] == "":
-                uid = parts[1]
-                machine = parts[2]
-                raw_date = parts[3]
-                raw_st = parts[4]
-                program = parts[5]
-                raw_duration = parts[6]
-                fle = parts[7]
-                permissions = parts[8]
-                start_time = datetime.datetime(int(raw_date[4:]) + 2000, int(raw_date[0:2]), int(raw_date[2:4]),
-                int(raw_st[0:2]), int(raw_st[2:4]), int(raw_st[4:]))
-                d_hours = raw_duration[0:2]
-                d_min = raw_duration[2:4]
-                d_sec = raw_duration[4:]
-                total_dur_seconds = d_hours * 3600 + d_min * 60 + d_sec
-
-                usr_idx = int(uid[1:]) - 1
-                resource = resources[usr_idx]
-                resource.incNumRecord()
+            else:
                 resource.incNumAccessRecord()
-                resource.addMachine(machine)
-                resource.addStartTime(start_time)
-                resource.addDuration(total_dur_seconds)
-                resource.addProgram(program)
-                resource.addFile(fle + ":" + permissions)
-        elif parts[0] == '3':
-            uid = parts[1]
-            machine = parts[2]
-            raw_date = parts[3]
-            raw_st = parts[4]
-            program = parts[5]
-            em = parts[6]
-            sent_rec = parts[7]
-            bites = parts[8] # since bytes is a reserved word
-            attachments = parts[9]
-            start_time = datetime.datetime(int(raw_date[4:]) + 2000, int(raw_date[0:2]), int(raw_date[2:4]),
-            int(raw_st[0:2]), int(raw_st[2:4]), int(raw_st[4:]))
-
-            email = emails[int(uid[1:]) - 1]
-            email.addMachine(machine)
-            email.addStartTime(start_time)
-            email.addEmailProgram(program)
-            email.addBytes(int(bites))
+            resource.addMachine(machine_idx)
+            file_idx = dataset.files.intern(fle)
+            permission_idx = dataset.permissions.intern(permissions)
+            resource.addFile(file_idx, permission_idx)
+            printer_idx = -1
+            if printer is not None:
+                printer_idx = dataset.printers.intern(printer)
+                resource.addPrinter(printer_idx)
+                dataset.prints.append((user_idx, printer_idx, pages))
+            dataset.accesses.append((user_idx, machine_idx, start_time, duration, dataset.programs.intern(program),
+            file_idx, printer_idx, permission_idx))
+        elif rtype == 3:
+            uid, machine, start_time, program, em, sent_rec, bites, attachments = rec
+            user_idx = dataset.userIndex(uid)
+            machine_idx = dataset.machines.intern(machine)
+            email = dataset.emails[user_idx]
+            program_idx = dataset.programs.intern(program)
+            address_idx = dataset.addresses.intern(em)
+            direction_idx = dataset.directions.intern(sent_rec)
+            email.addMachine(machine_idx)
+            email.addEmailProgram(program_idx)
             email.incCount()
-            email.addEmail(em + ":" + sent_rec)
-            email.addAttachments(int(attachments))      
-                
-        
+            email.addEmail(address_idx, direction_idx)
+            dataset.messages.append((user_idx, machine_idx, start_time, bites, attachments, program_idx, address_idx,
+            direction_idx))
+
+# ---- sharded ingest
+# the file is cut into byte ranges that start on a line, each range is parsed into
+# its own Dataset by a worker process, which sends it back packed into arrays, and
+# the parent merges all packs at once in file order
+
+INGEST_WORKERS = os.cpu_count() or 1
+MIN_SHARD_BYTES = 32 << 20 # smaller files are not worth starting processes for
+
+# splits bytes [start, end of file) into at most num_shards (start, end) byte ranges
+# on line boundaries; start has to be the start of a line
+def shardRanges(path, num_shards, start=0, end=None):
+    size = os.path.getsize(path) if end is None else end
+    bounds = [start]
+    with open(path, "rb") as file:
+        for i in range(1, num_shards):
+            file.seek(max(start + (size - start) * i // num_shards, bounds[-1]))
+            if file.tell() > start:
+                file.readline() # move on to the start of the next line
+            pos = min(file.tell(), size)
+            if pos > bounds[-1] and pos < size:
+                bounds.append(pos)
+    bounds.append(size)
+    return [r for r in zip(bounds[:-1], bounds[1:]) if r[0] < r[1]]
+
+def ingestShard(args):
+    path, start, end, sketch, types = args
+    dataset = Dataset(sketch)
+    aggregate(decodeRecords(logRecords(path, types, start, end)), dataset)
+    return dataset
+
+# ingestShard() in a worker process: the stores are joined into one array per column
+# and the dataset packed, so little more than arrays goes back
+def ingestShardPacked(args):
+    dataset = ingestShard(args)
+    for store in storeNames(dataset).values():
+        if isinstance(store, ColumnStore):
+            store.compact()
+    return packDataset(dataset)
+
+# parses the records of the given types from byte start (a line start) to byte end
+# (a line start, default the end of the file). A workbook is read in one piece by this process
+def ingest(path, workers=INGEST_WORKERS, sketch=False, start=0, types=RECORD_TYPES, end=None):
+    if isXlsx(path):
+        return ingestShard((path, 0, None, sketch, types))
+    num_shards = max(1, min(workers, ((os.path.getsize(path) if end is None else end) - start) // MIN_SHARD_BYTES))
+    shards = [(path, s, e, sketch, types) for s, e in shardRanges(path, num_shards, start, end)]
+    if len(shards) <= 1:
+        return ingestShard((path, start, end, sketch, types))
+    with multiprocessing.Pool(min(workers, len(shards))) as pool:
+        packs = pool.map(ingestShardPacked, shards)
+    return mergePacks(packs, sketch)
+
+# ---- parse cache and incremental updates
+# after a log is parsed its columns are written to a cache directory, one .npy file
+# per column, with the interners and per-user aggregates in a json file beside them.
+# A later run with the same log memory maps the columns instead of parsing. Caches
+# live under the user's cache directory (or --cache-dir), one per log named after it
+# and a hash of its absolute path, so nothing is written next to the data and nothing
+# there is ever loaded. The cache is keyed by the log's size and mtime; if only the
+# mtime changed the content hash decides. A cache that cannot be read or written is
+# skipped and the log is parsed as if there were none.
+# Logs only grow, so when the log is longer than when it was cached (and the bytes
+# just before the old end are unchanged) only the new bytes are parsed. They are
+# merged in and saved as one more segment of columns, so a daily run costs time for
+# the day's records only. Only parsing is incremental: k-means always starts from
+# the sweep's fixed seeds, so a log that grew gives the same groups as a fresh run on
+# the same bytes
+
+CACHE_VERSION = 6
+CACHE_TAIL_BYTES = 1 << 20 # bytes before the old end checked before appending
+USE_CACHE = True # --no-cache turns it off
+CACHE_ROOT = None # where caches go (--cache-dir); the user's cache directory when None
+INCREMENTAL = True
+
+def defaultCacheRoot():
+    base = os.environ.get("XDG_CACHE_HOME") or os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "py_parser")
+
+def cacheDir(path):
+    key = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16]
+    return os.path.join(CACHE_ROOT or defaultCacheRoot(), os.path.basename(path) + "-" + key)
+
+# true when directory is a cache this module wrote: it has a meta.json of ours
+def ownCache(directory):
+    try:
+        with open(os.path.join(directory, "meta.json")) as file:
+            meta = json.load(file)
+    except (OSError, ValueError):
+        return False
+    return isinstance(meta, dict) and "version" in meta
+
+def cacheWarning(path, error):
+    print("cache for " + path + " not used: " + str(error), file=sys.stderr)
+
+def rangeHash(path, start, end):
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        file.seek(start)
+        while start < end:
+            block = file.read(min(READ_BUFFER_SIZE, end - start))
+            if not block:
+                break
+            digest.update(block)
+            start += len(block)
+    return digest.hexdigest()
+
+# bytes of the log up to and including its last newline. A log that is being written
+# can end in half a line; the cache stops before it, as followLog does, and a later
+# run parses the line once it is whole. A workbook is always whole
+def completeSize(path):
+    size = os.path.getsize(path)
+    if isXlsx(path):
+        return size
+    with open(path, "rb") as file:
+        end = size
+        while end > 0:
+            start = max(end - READ_BUFFER_SIZE, 0)
+            file.seek(start)
+            newline = file.read(end - start).rfind(b"\n")
+            if newline >= 0:
+                return start + newline + 1
+            end = start
+    return 0
+
+def storeNames(dataset):
+    return {"logins": dataset.logins, "accesses": dataset.accesses, "messages": dataset.messages, "prints": dataset.prints}
+
+# a User, Resource or Email as json: counts keyed by ids (or pairs of ids) become
+# lists of [key..., count], in the dict's order
+def aggregateState(aggregate):
+    state = {}
+    for name, value in aggregate.__dict__.items():
+        if isinstance(value, dict):
+            value = [list(key) + [count] if isinstance(key, tuple) else [key, count] for key, count in value.items()]
+        state[name] = value
+    return state
+
+def loadAggregate(cls, state):
+    aggregate = cls(state["user_id"])
+    for name, value in state.items():
+        if isinstance(getattr(aggregate, name), dict):
+            value = {(tuple(entry[:-1]) if len(entry) > 2 else entry[0]): entry[-1] for entry in value}
+        setattr(aggregate, name, value)
+    return aggregate
+
+def saveAggregates(dataset, path):
+    state = {"interners": {interner: getattr(dataset, interner).names for interner in ID_COLUMNS.values()}}
+    for name in AGGREGATE_TYPES:
+        state[name] = [aggregateState(aggregate) for aggregate in getattr(dataset, name)]
+    with open(os.path.join(cacheDir(path), "aggregates.json"), "w") as file:
+        json.dump(state, file, default=int) # default: numpy integers
+
+def loadAggregates(dataset, path):
+    with open(os.path.join(cacheDir(path), "aggregates.json")) as file:
+        state = json.load(file)
+    for interner, names in state["interners"].items():
+        for name in names:
+            getattr(dataset, interner).intern(name)
+    for name, cls in AGGREGATE_TYPES.items():
+        setattr(dataset, name, [loadAggregate(cls, aggregate) for aggregate in state[name]])
+
+# writes rows [first_row[store], end) of every store as segment number, then the
+# aggregates and meta. meta is written last, so a half written cache is never used.
+# size is where the parsed bytes of the log end
+def saveSegment(dataset, path, meta, first_rows, size):
+    directory = os.path.join(cacheDir(path), "segment-" + str(len(meta["segments"])))
+    os.makedirs(directory, exist_ok=True)
+    for store_name, store in storeNames(dataset).items():
+        for name in store.names:
+            np.save(os.path.join(directory, store_name + "." + name + ".npy"), store.tail(name, first_rows[store_name]))
+    start = meta["size"]
+    meta["segments"].append({"start": start, "end": size, "sha1": rangeHash(path, start, size),
+    "tail_sha1": rangeHash(path, max(start, size - CACHE_TAIL_BYTES), size)})
+    meta["size"] = size
+    meta["mtime"] = os.stat(path).st_mtime_ns
+    saveAggregates(dataset, path)
+    with open(os.path.join(cacheDir(path), "meta.json"), "w") as file:
+        json.dump(meta, file)
+
+def loadMeta(path):
+    try:
+        with open(os.path.join(cacheDir(path), "meta.json")) as file:
+            meta = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if meta.get("version") != CACHE_VERSION:
+        return None
+    return meta
+
+def loadCached(path, meta):
+    directory = cacheDir(path)
+    dataset = Dataset()
+    loadAggregates(dataset, path)
+    for store_name, store in storeNames(dataset).items():
+        chunks = {}
+        for name in store.names:
+            chunks[name] = []
+            for i in range(len(meta["segments"])):
+                chunks[name].append(np.load(os.path.join(directory, "segment-" + str(i), store_name + "." + name + ".npy"),
+                mmap_mode="r"))
+        store.load(chunks)
+    return dataset
+
+# ingest() through the cache. Sketch mode keeps no columns, so it always parses.
+# A current cache has every record type; without one, a run that needs only some
+# types parses just those and leaves the cache alone
+def ingestCached(path, workers=INGEST_WORKERS, sketch=False, types=RECORD_TYPES):
+    if sketch or not USE_CACHE:
+        return ingest(path, workers, sketch, types=types)
+    meta = loadMeta(path)
+    size = completeSize(path)
+    stat = os.stat(path)
+    try:
+        if meta is not None and meta["size"] == size:
+            if meta["mtime"] == stat.st_mtime_ns:
+                return loadCached(path, meta)
+            if all(rangeHash(path, s["start"], s["end"]) == s["sha1"] for s in meta["segments"]):
+                meta["mtime"] = stat.st_mtime_ns # same content, touched; skip the hash next time
+                with open(os.path.join(cacheDir(path), "meta.json"), "w") as file:
+                    json.dump(meta, file)
+                return loadCached(path, meta)
+        elif INCREMENTAL and meta is not None and meta["size"] < size and types == RECORD_TYPES and not isXlsx(path):
+            last = meta["segments"][-1]
+            if rangeHash(path, max(last["start"], last["end"] - CACHE_TAIL_BYTES), last["end"]) == last["tail_sha1"]:
+                dataset = loadCached(path, meta)
+                first_rows = {}
+                for store_name, store in storeNames(dataset).items():
+                    first_rows[store_name] = len(store)
+                dataset = mergeDatasets([dataset, ingest(path, workers, start=meta["size"], end=size)])
+                try:
+                    saveSegment(dataset, path, meta, first_rows, size)
+                except OSError as error:
+                    cacheWarning(path, error)
+                return dataset
+    except (OSError, ValueError, KeyError) as error: # a cache that is damaged or cannot be read
+        cacheWarning(path, error)
+    if types != RECORD_TYPES:
+        return ingest(path, workers, types=types)
+    # no usable cache: parse everything and start a new one
+    dataset = ingest(path, workers, end=size)
+    try:
+        directory = cacheDir(path)
+        if os.path.lexists(directory):
+            if not ownCache(directory):
+                raise OSError(directory + " is in the way and is not a cache")
+            shutil.rmtree(directory)
+        saveSegment(dataset, path, {"version": CACHE_VERSION, "size": 0, "segments": []},
+        {"logins": 0, "accesses": 0, "messages": 0, "prints": 0}, size)
+    except OSError as error:
+        cacheWarning(path, error)
+    return dataset
+
+# kMeansSweep() for one family of points, timed as its own stage
+def clusterSweep(family, points, ks=range(2, 6)):
+    with PROFILER.stage("k-means sweep " + family, len(points)):
+        return kMeansSweep(points, ks)
+
+# ---------------------------------------------------------------------------------
+#       STAGE TIMING
+#       wall time, cpu time, peak memory and records handled for each part of a run.
+#       A disabled profiler returns straight away, so the calls stay in main()
+
+class NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_STAGE = NullStage()
+
+class Stage:
+    def __init__(self, profiler, name, records):
+        self.profiler = profiler
+        self.name = name
+        self.records = records
+
+    def __enter__(self):
+        self.profiler.begin(self.name, self.records)
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.end()
+        return False
+
+# stages nest; section() ends the open top level stage and starts the next one, for
+# code that runs one part after another like main(). Peak memory comes from
+# tracemalloc and is only kept with memory=True, since tracing slows Python code down
+class Profiler:
+    def __init__(self, enabled=False, memory=False):
+        self.reset(enabled, memory)
+
+    def reset(self, enabled=False, memory=False):
+        self.enabled = enabled
+        self.memory = enabled and memory
+        self.open = [] # stages begun and not ended, innermost last
+        self.stages = []
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def begin(self, name, records=0):
+        if not self.enabled:
+            return
+        if self.memory:
+            if self.open:
+                self.open[-1]["child_peak"] = max(self.open[-1]["child_peak"], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        # listed when they begin, so a stage comes before the ones inside it
+        stage = {"name": name, "depth": len(self.open), "wall_seconds": None, "cpu_seconds": None, "peak_bytes": None,
+        "max_rss_bytes": None, "records": records}
+        self.stages.append(stage)
+        self.open.append({"stage": stage, "wall": time.perf_counter(), "cpu": time.process_time(), "child_peak": 0})
+
+    def end(self, records=None):
+        if not self.enabled:
+            return
+        frame = self.open.pop()
+        stage = frame["stage"]
+        stage["wall_seconds"] = time.perf_counter() - frame["wall"]
+        stage["cpu_seconds"] = time.process_time() - frame["cpu"]
+        if records is not None:
+            stage["records"] = records
+        if self.memory:
+            stage["peak_bytes"] = max(frame["child_peak"], tracemalloc.get_traced_memory()[1])
+            if self.open:
+                self.open[-1]["child_peak"] = max(self.open[-1]["child_peak"], stage["peak_bytes"])
+        if resource is not None:
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            stage["max_rss_bytes"] = rss if sys.platform == "darwin" else rss * 1024 # kB elsewhere
+
+    # context manager around one stage
+    def stage(self, name, records=0):
+        if not self.enabled:
+            return NULL_STAGE
+        return Stage(self, name, records)
+
+    def section(self, name, records=0):
+        if not self.enabled:
+            return
+        while self.open:
+            self.end()
+        self.begin(name, records)
+
+    # ends whatever is still open
+    def finish(self):
+        if not self.enabled:
+            return
+        while self.open:
+            self.end()
+        if self.memory:
+            tracemalloc.stop()
+
+    def json(self):
+        return json.dumps({"stages": self.stages}, indent=1)
+
+    def table(self):
+        lines = ["%-36s %10s %10s %10s %10s %12s" % ("stage", "wall s", "cpu s", "peak MB", "rss MB", "records")]
+        for stage in self.stages:
+            peak = "-" if stage["peak_bytes"] is None else "%.1f" % (stage["peak_bytes"] / 1e6)
+            rss = "-" if stage["max_rss_bytes"] is None else "%.1f" % (stage["max_rss_bytes"] / 1e6)
+            lines.append("%-36s %10.4f %10.4f %10s %10s %12d" % ("  " * stage["depth"] + stage["name"],
+            stage["wall_seconds"], stage["cpu_seconds"], peak, rss, stage["records"]))
+        return "\n".join(lines)
+
+PROFILER = Profiler()
+
+# ---------------------------------------------------------------------------------
+#       FOLLOW MODE
+#       tails growing logs and keeps per user statistics over the last hour, day and
+#       week, served as json to anyone who connects while the logs are read
+
+# window name -> (bucket width in seconds, number of buckets)
+ROLLING_WINDOWS = {"hour": (60, 60), "day": (3600, 24), "week": (3600, 168)}
+# running sums kept per bucket; the longest session is a max, kept per bucket and
+# found over the live buckets when asked
+ROLLING_SUMS = ["sessions", "session_seconds", "login_seconds", "logout_seconds", "processes", "cpu",
+"chars_typed", "prints", "pages", "emails", "email_bytes"]
+FOLLOW_POLL_SECONDS = 1.0
+FOLLOW_BATCH_LINES = DECODE_BATCH_ROWS # lines decoded between chances for the server to answer
+FOLLOW_PORT = 8765
+
+# one user's records over one window: a deque of [bucket number, sums, longest
+# session] oldest first, and the sums of all of them. A record adds to one bucket and
+# to the totals; a bucket that falls out of the window is taken off the totals once,
+# so both are O(1) amortized
+class RollingWindow:
+    def __init__(self, width, count):
+        self.width = width
+        self.count = count
+        self.buckets = collections.deque()
+        self.totals = [0] * len(ROLLING_SUMS)
+
+    # drops the buckets that are no longer in the window ending at bucket number now
+    def evict(self, now):
+        while self.buckets and self.buckets[0][0] <= now - self.count:
+            sums = self.buckets.popleft()[1]
+            for i in range(len(sums)):
+                self.totals[i] -= sums[i]
+
+    # values are (index in ROLLING_SUMS, amount); now is the newest time seen
+    def add(self, time, values, longest, now):
+        number = time // self.width
+        self.evict(now // self.width)
+        if number <= now // self.width - self.count:
+            return # already out of the window
+        i = len(self.buckets)
+        while i > 0 and self.buckets[i - 1][0] > number: # late records are rare and near the end
+            i -= 1
+        if i > 0 and self.buckets[i - 1][0] == number:
+            bucket = self.buckets[i - 1]
+        else:
+            bucket = [number, [0] * len(ROLLING_SUMS), 0]
+            self.buckets.insert(i, bucket)
+        for j, value in values:
+            bucket[1][j] += value
+            self.totals[j] += value
+        bucket[2] = max(bucket[2], longest)
+
+    def longest(self):
+        return max([b[2] for b in self.buckets], default=0)
+
+SUM_INDEX = {name: i for i, name in enumerate(ROLLING_SUMS)}
+
+# rolling windows for every user, fed decoded records. Time is the log's own: the
+# newest record seen so far is "now", so replaying an old log gives the same windows
+class RollingStats:
+    def __init__(self, windows=ROLLING_WINDOWS):
+        self.windows = windows
+        self.generation = 0 # goes up on reset(), so followers know to read their logs again
+        self.reset()
+
+    # forgets every record; the next records seen rebuild the windows
+    def reset(self):
+        self.users = {} # user -> {window name: RollingWindow}
+        self.now = None
+        self.records = 0
+        self.skipped = 0 # lines that did not decode
+        self.generation += 1
+
+    def userWindows(self, uid):
+        windows = self.users.get(uid)
+        if windows is None:
+            windows = {name: RollingWindow(width, count) for name, (width, count) in self.windows.items()}
+            self.users[uid] = windows
+        return windows
+
+    def add(self, rtype, rec):
+        uid, time = rec[0], rec[2]
+        longest = 0
+        if rtype == 1:
+            uid, machine, start_time, end_time, num_proc, max_proc, chars_typed, cpu_use = rec
+            longest = end_time - start_time
+            values = [(SUM_INDEX["sessions"], 1), (SUM_INDEX["session_seconds"], longest),
+            (SUM_INDEX["login_seconds"], start_time % 86400), (SUM_INDEX["logout_seconds"], end_time % 86400),
+            (SUM_INDEX["processes"], num_proc), (SUM_INDEX["cpu"], cpu_use), (SUM_INDEX["chars_typed"], chars_typed)]
+        elif rtype == 2:
+            printer, pages = rec[7], rec[8]
+            if printer is None:
+                return
+            values = [(SUM_INDEX["prints"], 1), (SUM_INDEX["pages"], int(pages))]
+        else:
+            values = [(SUM_INDEX["emails"], 1), (SUM_INDEX["email_bytes"], rec[6])]
+        self.records += 1
+        if self.now is None or time > self.now:
+            self.now = time
+        for window in self.userWindows(uid).values():
+            window.add(time, values, longest, self.now)
+
+    # {"now": epoch seconds, "users": {user: {window: statistics}}}; averages are per
+    # session, start and end times are seconds of the day
+    def snapshot(self):
+        users = {}
+        for uid in sorted(self.users, key=naturalKey):
+            users[uid] = {}
+            for name, window in self.users[uid].items():
+                if self.now is not None:
+                    window.evict(self.now // window.width)
+                t = dict(zip(ROLLING_SUMS, window.totals))
+                sessions = max(t["sessions"], 1)
+                users[uid][name] = {"sessions": t["sessions"], "average_session": t["session_seconds"] / sessions,
+                "longest_session": window.longest(), "average_start": t["login_seconds"] / sessions,
+                "average_end": t["logout_seconds"] / sessions, "average_processes": t["processes"] / sessions,
+                "average_cpu": t["cpu"] / sessions, "average_chars_typed": t["chars_typed"] / sessions,
+                "prints": t["prints"], "pages": t["pages"], "emails": t["emails"], "email_bytes": t["email_bytes"]}
+        return {"now": self.now, "records": self.records, "skipped": self.skipped, "users": users}
+
+# true when path is no longer the file being read: it was replaced (a new inode, e.g.
+# rotated) or truncated below what has been read
+def logReplaced(path, file):
+    try:
+        now = os.stat(path)
+    except FileNotFoundError:
+        return False # moved away and the new one is not there yet
+    return now.st_ino != os.fstat(file.fileno()).st_ino or now.st_size < file.tell()
+
+# reads what is appended to path from byte offset start (the end when None) and adds it
+# to stats, forever. A line without its newline yet waits for the rest; lines that do
+# not decode are skipped and counted in stats.skipped. When the log is replaced or
+# truncated, stats are reset and every followed log is read again from its start, so
+# the windows are rebuilt from what the logs hold now
+async def followLog(path, stats, start=None, poll=FOLLOW_POLL_SECONDS):
+    file = open(path, "rb")
+    try:
+        file.seek(0, os.SEEK_END) if start is None else file.seek(start)
+        generation = stats.generation
+        partial = b""
+        while True:
+            if stats.generation != generation: # another log was replaced
+                generation = stats.generation
+                file.seek(0)
+                partial = b""
+            block = file.read(READ_BUFFER_SIZE)
+            if not block:
+                if logReplaced(path, file):
+                    file.close()
+                    file = open(path, "rb")
+                    partial = b""
+                    stats.reset()
+                    generation = stats.generation
+                else:
+                    await asyncio.sleep(poll)
+                continue
+            lines = (partial + block).split(b"\n")
+            partial = lines.pop()
+            for s in range(0, len(lines), FOLLOW_BATCH_LINES):
+                batch = [line.decode(errors="replace").split(',') for line in lines[s:s + FOLLOW_BATCH_LINES] if line.strip()]
+                dropped = []
+                for rtype, rec in decodeBatch(batch, dropped):
+                    stats.add(rtype, rec)
+                stats.skipped += len(dropped)
+                await asyncio.sleep(0) # let the server answer between batches
+                if stats.generation != generation:
+                    break # the rest is read again from the start
+    finally:
+        file.close()
+
+async def sendSnapshot(stats, reader, writer):
+    writer.write(json.dumps(stats.snapshot()).encode() + b"\n")
+    await writer.drain()
+    writer.close()
+
+# follows every path and answers each connection to port with the current snapshot
+async def follow(paths, port=FOLLOW_PORT, from_start=False, stats=None):
+    if stats is None:
+        stats = RollingStats()
+    server = await asyncio.start_server(lambda r, w: sendSnapshot(stats, r, w), "127.0.0.1", port)
+    async with server:
+        await asyncio.gather(*[followLog(path, stats, 0 if from_start else None) for path in paths])
+
+# ---------------------------------------------------------------------------------
+#       ANOMALY SCORING
+#       a compact baseline per user (robust center and spread of every metric of
+#       each record type, and the user's k-means group) and scores for new records:
+#       the root mean square of (value - center) / spread over the record's metrics.
+#       A record on a machine the user has never used scores PROFILE_NEW_MACHINE more
+
+# record type -> (store, metrics)
+PROFILE_METRICS = {
+    1: ("logins", ["duration", "login_of_day", "logout_of_day", "ave_proc", "max_proc", "chars_typed", "cpu"]),
+    2: ("accesses", ["duration", "start_of_day"]),
+    3: ("messages", ["bytes", "attachments", "start_of_day"]),
+}
+PROFILE_MIN_RECORDS = 5 # users with fewer logins are scored against their group
+PROFILE_MIN_SPREAD = 1.0 # in the metric's own unit, so a constant metric still scores
+PROFILE_NEW_MACHINE = 3.0
+IQR_TO_SIGMA = 1.349 # the iqr of a normal distribution in standard deviations
+
+# the PROFILE_METRICS of one decoded record, as decodeBatch yields it
+def recordMetrics(rtype, rec):
+    if rtype == 1:
+        uid, machine, start_time, end_time, num_proc, max_proc, chars_typed, cpu_use = rec
+        return [end_time - start_time, start_time % 86400, end_time % 86400, num_proc, max_proc, chars_typed, cpu_use]
+    if rtype == 2:
+        return [rec[3], rec[2] % 86400]
+    return [rec[6], rec[7], rec[2] % 86400]
+
+class AnomalyProfiles:
+    def __init__(self, users, centers, spreads, counts, machines, groups, centroids):
+        self.users = users # Interner of user names, rows of the arrays
+        self.centers = centers # record type -> (users, metrics) array
+        self.spreads = spreads
+        self.counts = counts # record type -> records per user
+        self.machines = machines # set of (user row, machine name) seen
+        self.groups = groups # login group of each user, -1 without logins
+        self.centroids = centroids # (groups, login metrics) raw units
+        self.rows = {} # record type -> per user lists for single records
+        for rtype in centers:
+            self.rows[rtype] = (centers[rtype].tolist(), (1 / spreads[rtype]).tolist())
+
+    # score of one decoded record (rtype, rec as decodeBatch yields it); nan for a user
+    # without a baseline of that record type
+    def scoreRecord(self, rtype, rec):
+        row = self.users.ids.get(rec[0])
+        if row is None:
+            return float("nan")
+        centers, inverse = self.rows[rtype]
+        center = centers[row]
+        if center[0] != center[0]: # nan
+            return float("nan")
+        total = 0.0
+        for x, c, s in zip(recordMetrics(rtype, rec), center, inverse[row]):
+            z = (x - c) * s
+            total += z * z
+        score = (total / len(center)) ** 0.5
+        if (row, rec[1]) not in self.machines:
+            score += PROFILE_NEW_MACHINE
+        return score
+
+    # scores of one csv line, [] when it is not a record that is scored
+    def scoreLine(self, line):
+        return [self.scoreRecord(rtype, rec) for rtype, rec in decodeBatch([line.rstrip("\n").split(',')])]
+
+    # scores of every row of a dataset's stores: {record type: array in store order}
+    def scoreDataset(self, dataset):
+        scores = {}
+        rows = np.array([self.users.ids.get(name, -1) for name in dataset.users.names], dtype=np.int64)
+        rows = np.append(rows, -1) # so an empty dataset still indexes
+        known = self.knownMachines(dataset)
+        num_machines = max(len(dataset.machines), 1)
+        for rtype, (store_name, metrics) in PROFILE_METRICS.items():
+            store = getattr(dataset, store_name)
+            if len(store) == 0:
+                scores[rtype] = np.zeros(0)
+                continue
+            user_rows = rows[store.column("user")]
+            values = np.column_stack([store.column(m) for m in metrics]).astype(float)
+            has_row = user_rows >= 0
+            safe = np.where(has_row, user_rows, 0)
+            z = (values - self.centers[rtype][safe]) / self.spreads[rtype][safe]
+            score = np.sqrt((z * z).mean(axis=1))
+            score[~has_row] = np.nan
+            score += np.where(np.isin(safe * num_machines + store.column("machine"), known), 0, PROFILE_NEW_MACHINE)
+            scores[rtype] = score
+        return scores
+
+    # our row * machines + dataset machine id of every (user, machine) seen before
+    def knownMachines(self, dataset):
+        num_machines = max(len(dataset.machines), 1)
+        known = []
+        for row, name in self.machines:
+            m = dataset.machines.ids.get(name)
+            if m is not None:
+                known.append(row * num_machines + m)
+        return np.array(known, dtype=np.int64)
+
+    def save(self, path):
+        arrays = {"users": np.array(self.users.names), "groups": self.groups, "centroids": self.centroids,
+        "machine_rows": np.array([r for r, m in sorted(self.machines)], dtype=np.int64),
+        "machine_names": np.array([m for r, m in sorted(self.machines)])}
+        for rtype in self.centers:
+            arrays["center" + str(rtype)] = self.centers[rtype]
+            arrays["spread" + str(rtype)] = self.spreads[rtype]
+            arrays["count" + str(rtype)] = self.counts[rtype]
+        with open(path, "wb") as file:
+            np.savez_compressed(file, **arrays)
+
+def loadProfiles(path):
+    with np.load(path) as data:
+        users = Interner()
+        for name in data["users"].tolist():
+            users.intern(name)
+        centers = {}
+        spreads = {}
+        counts = {}
+        for rtype in PROFILE_METRICS:
+            centers[rtype] = data["center" + str(rtype)]
+            spreads[rtype] = data["spread" + str(rtype)]
+            counts[rtype] = data["count" + str(rtype)]
+        machines = set(zip(data["machine_rows"].tolist(), data["machine_names"].tolist()))
+        return AnomalyProfiles(users, centers, spreads, counts, machines, data["groups"], data["centroids"])
+
+# baselines from a dataset: center is the outlier-trimmed mean the report prints and
+# spread the iqr as a standard deviation. Users are grouped on their login centers
+# with kMeansSweep at the recommended k; a user with few logins takes the center of
+# their group, and the median spread
+def buildProfiles(dataset):
+    users = Interner()
+    for uid in range(len(dataset.users)):
+        users.intern(dataset.users.names[uid])
+    n = len(users)
+    centers = {}
+    spreads = {}
+    counts = {}
+    for rtype, (store_name, metrics) in PROFILE_METRICS.items():
+        store = getattr(dataset, store_name)
+        centers[rtype] = np.full((n, len(metrics)), np.nan)
+        spreads[rtype] = np.ones((n, len(metrics)))
+        counts[rtype] = np.zeros(n, dtype=np.int64)
+        for uid in range(n):
+            for j, name in enumerate(metrics):
+                summary = store.robust(uid, name)
+                if summary.count == 0:
+                    continue
+                counts[rtype][uid] = summary.count
+                centers[rtype][uid, j] = summary.trimmed_mean
+                spreads[rtype][uid, j] = max(summary.iqr / IQR_TO_SIGMA, PROFILE_MIN_SPREAD)
+    groups = np.full(n, -1, dtype=np.int64)
+    centroids = np.zeros((0, len(PROFILE_METRICS[1][1])))
+    with_logins = np.flatnonzero(counts[1] > 0)
+    if len(with_logins) >= 2:
+        models, k = kMeansSweep(normalize(centers[1][with_logins].tolist()), range(2, min(5, len(with_logins)) + 1))
+        groups[with_logins] = models[k]["labels"]
+        centroids = np.array([centers[1][with_logins[models[k]["labels"] == g]].mean(axis=0)
+        if np.any(models[k]["labels"] == g) else np.full(centers[1].shape[1], np.nan) for g in range(k)])
+        few = with_logins[counts[1][with_logins] < PROFILE_MIN_RECORDS]
+        centers[1][few] = centroids[groups[few]]
+        spreads[1][few] = np.median(spreads[1][with_logins], axis=0)
+    machines = set()
+    for uid in range(n):
+        for owner in (dataset.type_one_users[uid], dataset.resources[uid], dataset.emails[uid]):
+            machines.update((uid, dataset.machines.names[m]) for m in owner.machines)
+    return AnomalyProfiles(users, centers, spreads, counts, machines, groups, centroids)
+
+# prints the top highest scoring records of a scored dataset
+def printAnomalies(dataset, scores, top):
+    found = []
+    for rtype, (store_name, metrics) in PROFILE_METRICS.items():
+        store = getattr(dataset, store_name)
+        if len(store) == 0:
+            continue
+        rows = np.flatnonzero(~np.isnan(scores[rtype]))
+        best = rows[np.argsort(-scores[rtype][rows], kind="stable")[:top]]
+        times = store.column("login" if rtype == 1 else "start_time")
+        for r in best.tolist():
+            found.append((float(scores[rtype][r]), rtype, dataset.users.names[store.column("user")[r]],
+            dataset.machines.names[store.column("machine")[r]], int(times[r])))
+    found.sort(key=lambda f: -f[0])
+    print("Score, type, user, machine, date, time")
+    for score, rtype, user, machine, t in found[:top]:
+        date = datetime.date.fromordinal(EPOCH_ORDINAL + t // 86400)
+        print(str(round(score, 3)) + ", " + str(rtype) + ", " + user + ", " + machine + ", " + str(date) + ", "
+        + secondsToFormattedTime(t % 86400))
+
+# ---------------------------------------------------------------------------------
+#       NEAREST NEIGHBOURS
+#       an index over the per-user feature vectors the clustering uses, answering
+#       "the k users most like U07" and "every user within r of U07". Features are
+#       scaled with the min and max of the vectors the index was built from; they are
+#       kept, so vectors added later are scaled the same way. Rows live in a KD-tree
+#       (split on the widest dimension at the median, a bounding box per node), with
+#       a NumPy brute-force scan while there are too few rows for the tree to pay off.
+#       Added and changed users go in a pending list that is scanned by brute force
+#       until it is big enough to rebuild the tree
+
+NEIGHBOUR_LEAF_ROWS = 128 # rows scanned together; smaller leaves cost more Python per query than they save
+NEIGHBOUR_TREE_ROWS = 1 << 15 # fewer rows (or fewer than 2 ** dimensions) are scanned instead
+NEIGHBOUR_REBUILD_SHARE = 0.25 # pending rows, as a share of the tree, that trigger a rebuild
+
+class NeighbourIndex:
+    def __init__(self, low, span, leaf_rows=NEIGHBOUR_LEAF_ROWS, tree_rows=NEIGHBOUR_TREE_ROWS):
+        self.low = np.asarray(low, dtype=float)
+        self.span = np.asarray(span, dtype=float)
+        self.leaf_rows = leaf_rows
+        self.tree_rows = tree_rows
+        self.names = [] # user name of each row
+        self.rows = {} # user name -> current row
+        self.points = np.zeros((0, len(self.low))) # scaled, one row per vector ever added
+        self.alive = np.zeros(0, dtype=bool) # False for a row replaced by a later one
+        self.pending = np.zeros(0, dtype=np.int64) # rows not in the tree
+        self.order = np.zeros(0, dtype=np.int64) # rows in the tree; each node is a slice of it
+        self.nodes = np.zeros((0, 4), dtype=np.int64) # start, end, left, right; left is -1 for a leaf
+        self.boxes = np.zeros((0, 2, len(self.low))) # low and high corner of each node's rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def scale(self, vectors):
+        return (np.asarray(vectors, dtype=float) - self.low) / self.span
+
+    # adds users, or replaces the vectors of users already in; unchanged vectors stay
+    # where they are. Vectors are raw (unscaled) rows
+    def update(self, names, vectors):
+        points = self.scale(vectors).reshape(len(names), len(self.low))
+        changed = []
+        for i, name in enumerate(names):
+            row = self.rows.get(name)
+            if row is not None:
+                if np.array_equal(self.points[row], points[i]):
+                    continue
+                self.alive[row] = False
+            self.rows[name] = len(self.names)
+            self.names.append(name)
+            changed.append(i)
+        if not changed:
+            return
+        first = len(self.points)
+        self.points = np.concatenate([self.points, points[changed]])
+        self.alive = np.concatenate([self.alive, np.ones(len(changed), dtype=bool)])
+        self.pending = np.concatenate([self.pending, np.arange(first, len(self.points))])
+        if len(self.pending) > NEIGHBOUR_REBUILD_SHARE * len(self.order):
+            self.rebuild()
+
+    # drops replaced rows and puts every row in a new tree, or leaves them all pending
+    # when there are too few for one
+    def rebuild(self):
+        keep = np.flatnonzero(self.alive)
+        self.points = self.points[keep]
+        self.alive = self.alive[keep]
+        self.names = [self.names[r] for r in keep.tolist()]
+        self.rows = {name: r for r, name in enumerate(self.names)}
+        n, d = self.points.shape
+        if n < max(self.tree_rows, 2 ** d):
+            self.pending = np.arange(n)
+            self.order = np.zeros(0, dtype=np.int64)
+            self.nodes = np.zeros((0, 4), dtype=np.int64)
+            self.boxes = np.zeros((0, 2, d))
+            return
+        self.pending = np.zeros(0, dtype=np.int64)
+        self.order = np.arange(n)
+        nodes = [[0, n, -1, -1]]
+        boxes = []
+        todo = [0]
+        while todo:
+            node = todo.pop()
+            start, end = nodes[node][0], nodes[node][1]
+            points = self.points[self.order[start:end]]
+            low = points.min(axis=0)
+            high = points.max(axis=0)
+            boxes.append((node, low, high))
+            if end - start <= self.leaf_rows:
+                continue
+            dim = int(np.argmax(high - low))
+            if high[dim] == low[dim]:
+                continue # every row the same, nothing to split
+            mid = (end - start) // 2
+            self.order[start:end] = self.order[start:end][np.argpartition(points[:, dim], mid)]
+            nodes[node][2] = len(nodes)
+            nodes[node][3] = len(nodes) + 1
+            nodes.append([start, start + mid, -1, -1])
+            nodes.append([start + mid, end, -1, -1])
+            todo.extend([len(nodes) - 2, len(nodes) - 1])
+        self.nodes = np.array(nodes, dtype=np.int64)
+        self.boxes = np.zeros((len(nodes), 2, d))
+        for node, low, high in boxes:
+            self.boxes[node, 0] = low
+            self.boxes[node, 1] = high
+
+    # squared distance from a scaled point to the box of each node
+    def boxDistances(self, point, nodes):
+        below = np.maximum(self.boxes[nodes, 0] - point, 0)
+        above = np.maximum(point - self.boxes[nodes, 1], 0)
+        return (below ** 2).sum(axis=1) + (above ** 2).sum(axis=1)
+
+    # live rows among rows and their squared distances to a scaled point
+    def scan(self, point, rows):
+        rows = rows[self.alive[rows]]
+        return rows, ((self.points[rows] - point) ** 2).sum(axis=1)
+
+    # the k nearest live rows to a scaled point, nearest first, as (rows, squared
+    # distances); ties go to the lower row so the tree and a scan agree
+    def nearestRows(self, point, k, exclude=-1):
+        rows, dists = self.scan(point, self.pending)
+        best_rows, best = self.keepNearest(rows, dists, k, exclude)
+        if len(self.nodes):
+            heap = [(0.0, 0)]
+            while heap:
+                bound, node = heapq.heappop(heap)
+                if len(best) == k and bound > best[-1]:
+                    break
+                start, end, left, right = self.nodes[node].tolist()
+                if left < 0:
+                    rows, dists = self.scan(point, self.order[start:end])
+                    best_rows, best = self.keepNearest(np.concatenate([best_rows, rows]),
+                    np.concatenate([best, dists]), k, exclude)
+                    continue
+                children = np.array([left, right])
+                for child, child_bound in zip(children.tolist(), self.boxDistances(point, children).tolist()):
+                    heapq.heappush(heap, (child_bound, child))
+        return best_rows, best
+
+    def keepNearest(self, rows, dists, k, exclude):
+        mine = rows != exclude
+        rows = rows[mine]
+        dists = dists[mine]
+        nearest = np.lexsort((rows, dists))[:k]
+        return rows[nearest], dists[nearest]
+
+    # every live row within radius of a scaled point, nearest first
+    def rowsWithin(self, point, radius, exclude=-1):
+        limit = radius * radius
+        rows, dists = self.scan(point, self.pending)
+        found_rows = [rows[dists <= limit]]
+        found = [dists[dists <= limit]]
+        todo = [0] if len(self.nodes) else []
+        while todo:
+            node = todo.pop()
+            start, end, left, right = self.nodes[node].tolist()
+            if left < 0:
+                rows, dists = self.scan(point, self.order[start:end])
+                found_rows.append(rows[dists <= limit])
+                found.append(dists[dists <= limit])
+                continue
+            children = np.array([left, right])
+            todo.extend(children[self.boxDistances(point, children) <= limit].tolist())
+        rows = np.concatenate(found_rows)
+        dists = np.concatenate(found)
+        return self.keepNearest(rows, dists, len(rows), exclude)
+
+    # a user's name or a raw vector -> (scaled point, row to leave out of the answer)
+    def queryPoint(self, query):
+        if isinstance(query, str):
+            row = self.rows[query]
+            return self.points[row], row
+        return self.scale(query), -1
+
+    # [(user, distance)] of the k users nearest a user (by name, the user is left out)
+    # or a raw vector; distances are in scaled units
+    def nearest(self, query, k):
+        point, exclude = self.queryPoint(query)
+        rows, dists = self.nearestRows(point, k, exclude)
+        return [(self.names[r], d ** 0.5) for r, d in zip(rows.tolist(), dists.tolist())]
+
+    # [(user, distance)] of every user within radius, nearest first
+    def within(self, query, radius):
+        point, exclude = self.queryPoint(query)
+        rows, dists = self.rowsWithin(point, radius, exclude)
+        return [(self.names[r], d ** 0.5) for r, d in zip(rows.tolist(), dists.tolist())]
+
+    def save(self, path):
+        with open(path, "wb") as file:
+            np.savez_compressed(file, low=self.low, span=self.span, leaf_rows=self.leaf_rows, tree_rows=self.tree_rows,
+            names=np.array(self.names), points=self.points, alive=self.alive, pending=self.pending, order=self.order,
+            nodes=self.nodes, boxes=self.boxes)
+
+def loadNeighbours(path):
+    with np.load(path) as data:
+        index = NeighbourIndex(data["low"], data["span"], int(data["leaf_rows"]), int(data["tree_rows"]))
+        index.names = data["names"].tolist()
+        index.points = data["points"]
+        index.alive = data["alive"]
+        index.rows = {}
+        for r in np.flatnonzero(index.alive).tolist():
+            index.rows[index.names[r]] = r
+        index.pending = data["pending"]
+        index.order = data["order"]
+        index.nodes = data["nodes"]
+        index.boxes = data["boxes"]
+        return index
+
+# a new index over raw vectors, scaled to [0, 1] by their own min and max like normalize()
+def buildNeighbours(names, vectors, leaf_rows=NEIGHBOUR_LEAF_ROWS, tree_rows=NEIGHBOUR_TREE_ROWS):
+    vectors = np.asarray(vectors, dtype=float)
+    low = vectors.min(axis=0)
+    span = vectors.max(axis=0) - low
+    span[span == 0] = 1
+    index = NeighbourIndex(low, span, leaf_rows, tree_rows)
+    index.update(names, vectors)
+    index.rebuild()
+    return index
+
+# ---------------------------------------------------------------------------------
+
+SKETCH_MODE = False # approximate outlier trimming in constant memory per user
+APPROX_SIMILARITY = False # MinHash/LSH instead of every pair for the file similarity sweep
+SIMILARITY_RECALL = 0.95
+PROFILE = False # time each part of the run, printed to stderr at the end
+PROFILE_MEMORY = False # also the peak memory of each part (slower)
+PROFILE_OUTPUT = None # write the timings to this json file instead
+MACHINE_MATRIX_CSV = None # machine-usage also writes the matrix here (--machine-csv)
+MACHINE_RANGE = "M01-M30" # the lab's machines, the layout of Machine_type_one_matrix.csv
+MACHINE_COLUMNS = None # machine names the matrix starts with (--machines, MACHINE_RANGE by default)
+
+# appended to a "without outliers" number when it came from a sketch
+def errorBound(summary):
+    if summary.error == 0:
+        return ""
+    return " (+/-" + str(round(summary.error * 100, 2)) + "% rank)"
+    
+# ---- report sections
+# the report is a list of named sections, printed in the order of REPORT_SECTIONS.
+# Each section names the record types it reads; when the log has to be parsed only
+# those records are decoded. Values several sections share (the user lists, the per
+# user numbers clustering uses) are worked out by Report the first time one asks
+
+# the keys of a dict, or the items of a list, sorted by name. The aggregates keep
+# things in the order they were first seen, which depends on the order of the log;
+# the report lists them by name so a log in any order prints the same
+def byName(items):
+    if isinstance(items, dict):
+        return {key: items[key] for key in sorted(items, key=naturalKey)}
+    return sorted(items, key=naturalKey)
+
+class Report:
+    def __init__(self, dataset, path):
+        self.dataset = dataset
+        self.path = path
+        # users are listed by name; order[i] is the dataset's id of the i-th user listed
+        self.order = dataset.userOrder()
+        self.type_one_users = [dataset.type_one_users[i] for i in self.order]
+        self.resources = [dataset.resources[i] for i in self.order]
+        self.emails = [dataset.emails[i] for i in self.order]
+        self.names = [dataset.users.names[i] for i in self.order]
+        self.values = {}
+
+    def averageTimeWorked(self):
+        if "average_time_worked" not in self.values:
+            self.values["average_time_worked"] = [int(self.dataset.logins.robust(self.order[i], "duration").trimmed_sum
+            / max(user.num_records, 1)) for i, user in enumerate(self.type_one_users)]
+        return self.values["average_time_worked"]
+
+    # (position, User) of the users that have logins; users are made by the first record
+    # of any type, so some may have none and the login statistics leave them out
+    def loginUsers(self):
+        return [(i, user) for i, user in enumerate(self.type_one_users) if user.num_records > 0]
+
+    def longestDay(self):
+        return [user.longest_day for user in self.type_one_users]
+
+    # trimmed mean of a login column for every user, as int
+    def averageTimeOfDay(self, name):
+        if name not in self.values:
+            self.values[name] = [int(self.dataset.logins.robust(user, name).trimmed_mean) for user in self.order]
+        return self.values[name]
+
+    # user -> {file:permissions: count}, files by name
+    def fileAccesses(self):
+        if "file_accesses" not in self.values:
+            files = self.dataset.files.names
+            permissions = self.dataset.permissions.names
+            file_accesses = {}
+            for r in self.resources:
+                file_accesses[r.user_id] = byName({files[f] + ":" + permissions[p]: count
+                for (f, p), count in r.file_counts.items()})
+            self.values["file_accesses"] = file_accesses
+        return self.values["file_accesses"]
+
+    def emailSentTimes(self):
+        if "email_sent_times" not in self.values:
+            self.values["email_sent_times"] = [int(self.dataset.messages.robust(user, "start_of_day").trimmed_mean)
+            for user in self.order]
+        return self.values["email_sent_times"]
+
+def loginStats(report):
+    order = report.order
+    logins = report.dataset.logins
     print("Average time worked:")
-    average_time_worked = []
-    for user in type_one_users:
+    average_time_worked = report.averageTimeWorked()
+    for i, user in report.loginUsers():
         with_outliers = user.total_time / user.num_records
-        without_outliers = int(sum(removeOutliers(user.times)) / user.num_records)
-        average_time_worked.append(without_outliers)
-        print(user.user_id + ": " + secondsToFormattedTime(with_outliers) + ", " + str(secondsToFormattedTime(without_outliers)))
+        without_outliers = average_time_worked[i]
+        print(user.user_id + ": " + secondsToFormattedTime(with_outliers) + ", " + str(secondsToFormattedTime(without_outliers)) + errorBound(logins.robust(order[i], "duration")))
         
     print("Longest day:")
-    longest_day = []
-    for user in type_one_users:
-        longest_day.append(user.longest_day)
+    for i, user in report.loginUsers():
         print(user.user_id + ": " + secondsToFormattedTime(user.longest_day))
 
     print("Average processes, average:")
-    for user in type_one_users:
-        without_outliers = sum(removeOutliers(user.ave_procs)) / len(removeOutliers(user.ave_procs))
-        print(user.user_id + ": " + str(user.total_ave_proc / user.num_records) + ", " + str(without_outliers))
+    for i, user in report.loginUsers():
+        print(user.user_id + ": " + str(user.total_ave_proc / user.num_records) + ", " + str(logins.robust(order[i], "ave_proc").trimmed_mean) + errorBound(logins.robust(order[i], "ave_proc")))
 
     print("Max processes, average:")
-    for user in type_one_users:
-        without_outliers = sum(removeOutliers(user.max_proc_l)) / len(removeOutliers(user.max_proc_l))
-        print(user.user_id + ": " + str(user.total_max_proc / user.num_records) + ", " + str(without_outliers))
+    for i, user in report.loginUsers():
+        print(user.user_id + ": " + str(user.total_max_proc / user.num_records) + ", " + str(logins.robust(order[i], "max_proc").trimmed_mean) + errorBound(logins.robust(order[i], "max_proc")))
 
     print("Max processes, max:")
-    for user in type_one_users:
+    for i, user in report.loginUsers():
         print(user.user_id + ": " + str(user.max_proc))
 
     print("Average characters typed:")
-    for user in type_one_users:
-        without_outliers = sum(removeOutliers(user.chars_typed)) / len(removeOutliers(user.chars_typed))
-        print(user.user_id + ": " + str(user.total_chars_typed / user.num_records) + ", " + str(without_outliers))
+    for i, user in report.loginUsers():
+        print(user.user_id + ": " + str(user.total_chars_typed / user.num_records) + ", " + str(logins.robust(order[i], "chars_typed").trimmed_mean) + errorBound(logins.robust(order[i], "chars_typed")))
 
     print("Average CPU:")
-    for user in type_one_users:
-        without_outliers = sum(removeOutliers(user.cpus)) / len(removeOutliers(user.cpus))
-        print(user.user_id + ": " + str(user.total_cpu / user.num_records) + ", " + str(without_outliers))
+    for i, user in report.loginUsers():
+        print(user.user_id + ": " + str(user.total_cpu / user.num_records) + ", " + str(logins.robust(order[i], "cpu").trimmed_mean) + errorBound(logins.robust(order[i], "cpu")))
 
     print("Max CPU:")
-    for user in type_one_users:
+    for i, user in report.loginUsers():
         print(user.user_id + ": " + str(user.max_cpu))
 
-    user_machines = []
-    for l in range(19):
-        tmp = []
-        for i in range(30):
-            tmp.append(0)
-        user_machines.append(tmp)
-        
+def machineUsage(report):
+    matrix = machineMatrix(report.dataset, report.order, MACHINE_COLUMNS)
     print("Usage per machine:")
-    for user in type_one_users:
-        uid = int(user.user_id[1:]) - 1
-        for machine in user.machines:
-            num = int(machine[1:]) - 1
-            user_machines[uid][num] += 1
-
-    for l in user_machines:
-        for i in l:
-            print(i, end=',')
-        print()
-
-    print("Average start time:")
-    average_start_time = []
-    for user in type_one_users:
-        s = 0
-        stimes = 0
-        start_times_seconds = []
-        for st in user.logins:
-            tmpdt = datetime.datetime(st.year, st.month, st.day, 0, 0, 0)
-            diff = (st - tmpdt).total_seconds() # gets the time without day, month or year attached
-            start_times_seconds.append(diff)
-            stimes += diff
-            s += 1
-        l = removeOutliers(start_times_seconds)
-        average_start_time.append(int(sum(l) / len(l)))
-        print(user.user_id + ": " + str(secondsToFormattedTime(stimes / s)) + ", " + str(secondsToFormattedTime(sum(l) / len(l))))
-
-
-    print("Average end time:")
-    average_end_time = []
-    for user in type_one_users:
-        s = 0
-        etimes = 0
-        end_times_seconds = []
-        for et in user.logouts:
-            tmpdt = tmpdt = datetime.datetime(et.year, et.month, et.day, 0, 0, 0)
-            diff = (et - tmpdt).total_seconds()
-            end_times_seconds.append(diff)
-            etimes += diff
-            s += 1
-        l = removeOutliers(end_times_seconds)
-        average_end_time.append(int(sum(l) / len(l)))
-        print(user.user_id + ": " + str(secondsToFormattedTime(etimes / s)) + ", " + str(secondsToFormattedTime(sum(l) / len(l))))
+    print(",".join(matrix.machines) + ",")
+    for r in range(len(matrix.users)):
+        print(",".join(map(str, matrix.denseRow(r).tolist())) + ",")
+    if MACHINE_MATRIX_CSV:
+        matrix.writeCsv(MACHINE_MATRIX_CSV)
 
+def loginTimes(report):
+    logins = report.dataset.logins
+    for title, name in [("Average start time:", "login_of_day"), ("Average end time:", "logout_of_day")]:
+        print(title)
+        for i, user in report.loginUsers():
+            summary = logins.robust(report.order[i], name)
+            print(user.user_id + ": " + str(secondsToFormattedTime(summary.total / summary.count)) + ", " + str(secondsToFormattedTime(summary.trimmed_mean)) + errorBound(summary))
 
+def fileStats(report):
     print("File accesses and prints")
-    for r in resources:
+    for r in report.resources:
         print(r.user_id + ": " + str(r.accesses) + ", " + str(r.printed) + ", " + str(r.num_records))
 
     print("File accesses based on files")
-    file_accesses = {}
-    for r in resources:
-        files = {}
-        for f in r.files:
-            if f not in files:
-                files[f] = 1
-            else:
-                files[f] += 1
+    file_accesses = report.fileAccesses()
+    for r in report.resources:
         print(r.user_id)
-        print(files)
-        file_accesses[r.user_id] = files
+        print(file_accesses[r.user_id])
 
+def daysWorked(report):
     print("Days worked")
-    for user in type_one_users:
+    for i, user in report.loginUsers():
         print(user.user_id + ":")
         print("\t" + "Sunday: " + str(user.days_worked[6]))
         print("\t" + "Monday: " + str(user.days_worked[0]))
@@ -500,18 +2834,34 @@ def main():
         print("\t" + "Friday: " + str(user.days_worked[4]))
         print("\t" + "Saturday: " + str(user.days_worked[5]))
         
+def pagesPrinted(report):
     print("\n\nAverage pages printed, per user")
-    pages_printed = []
-    [pages_printed.append([x.split(':')[1] for x in r.printers]) for r in resources]
-    [print(str(sum([int(x) for x in p]) / len(p)) + ", " + str(sum(removeOutliers([int(x) for x in p])) / len(removeOutliers([int(x) for x in p])))) for p in pages_printed]
+    prints = report.dataset.prints
+    for uid in report.order:
+        summary = prints.robust(uid, "pages")
+        if summary.count == 0:
+            print("-, -") # nothing printed
+            continue
+        print(str(summary.total / summary.count) + ", " + str(summary.trimmed_mean) + errorBound(summary))
 
-    print("\n\n\n\n\n\n\n\nEnd of statistics...beginning of correlation and clustering\n\n\n")
-    
-    
+# prints the best groups for k = 2..5 with their scores and the recommended k
+def printClusters(report, family, points):
+    models, recommended = clusterSweep(family, points)
+    for k in models:
+        print("k=" + str(k) + "\n")
+        print(labelsToGroups(models[k]["labels"], k, report.names))
+        print("inertia: " + str(round(models[k]["inertia"], 4)) + ", silhouette: " + str(round(models[k]["silhouette"], 4)))
+    print("Recommended k: " + str(recommended) + "\n")
+
+def loginClusters(report):
     print("Cluster based on login information\n\n\n")
     
     points = []
-    for i in range(len(type_one_users)):
+    average_time_worked = report.averageTimeWorked()
+    longest_day = report.longestDay()
+    average_start_time = report.averageTimeOfDay("login_of_day")
+    average_end_time = report.averageTimeOfDay("logout_of_day")
+    for i in range(len(report.type_one_users)):
         l = []
         l.append(average_time_worked[i])
         l.append(longest_day[i])
@@ -519,175 +2869,341 @@ def main():
         l.append(average_end_time[i])
         points.append(l)
     points = normalize(points)
+    printClusters(report, "login", points)
     
-    print("k=2\n")
-    
-    refs = [[0,0,0,0],[1,1,1,1]]
-    print(k_meansClusterFull(refs, points))
-    
-    print("k=3\n")
-    refs = [[0,0,0,0],[.5,.5,.5,.5],[1,1,1,1]]
-    print(k_meansClusterFull(refs, points))
-    
-    print("k=4\n")
-    refs = [[0,0,0,0],[.3,.3,.3,.3],[.6,.6,.6,.6],[1,1,1,1]]
-    print(k_meansClusterFull(refs, points))
-    
-    print("k=5\n")
-    refs = [[0,0,0,0],[.25,.25,.25,.25],[.5,.5,.5,.5],[.75,.75,.75,.75],[1,1,1,1]]
-    print(k_meansClusterFull(refs, points))
-    
+def programClusters(report):
+    logins = report.dataset.logins
+    order = report.order
     points = []
-    for u in type_one_users:
+    for i in range(len(report.type_one_users)):
         l = []
-        l.append(sum(removeOutliers(u.ave_procs)) / len(removeOutliers(u.ave_procs)))
-        l.append(sum(removeOutliers(u.max_proc_l)) / len(removeOutliers(u.max_proc_l)))
-        l.append(sum(removeOutliers(u.chars_typed)) / len(removeOutliers(u.chars_typed)))
-        l.append(sum(removeOutliers(u.cpus)) / len(removeOutliers(u.cpus)))
+        l.append(logins.robust(order[i], "ave_proc").trimmed_mean)
+        l.append(logins.robust(order[i], "max_proc").trimmed_mean)
+        l.append(logins.robust(order[i], "chars_typed").trimmed_mean)
+        l.append(logins.robust(order[i], "cpu").trimmed_mean)
         points.append(l)
     print(points)
         
     points = normalize(points)
     
     print("Cluster based on program access\n\n\n")
+    printClusters(report, "program", points)
     
-    refs = [[0,0,0,0],[1,1,1,1]]
-    print("k=2\n")
-    print(k_meansClusterFull(refs, points))
-    
-    refs = [[0,0,0,0],[.5,.5,.5,.5],[1,1,1,1]]
-    print("k=3\n")
-    print(k_meansClusterFull(refs, points))
-    
-    refs = [[0,0,0,0],[.3,.3,.3,.3],[.6,.6,.6,.6],[1,1,1,1]]
-    print("k=4\n")
-    print(k_meansClusterFull(refs, points))
-    
-    refs = [[0,0,0,0],[.25,.25,.25,.25],[.5,.5,.5,.5],[.75,.75,.75,.75],[1,1,1,1]]
-    print("k=5\n")
-    print(k_meansClusterFull(refs, points))
-    
+# every login session clustered with MiniBatchKMeans; a user goes in the group most
+# of their sessions are in. Sketch mode keeps no sessions, so they are read again from the log
+def sessionClusters(report):
+    dataset = report.dataset
+    if SKETCH_MODE:
+        batches = lambda: streamSessionBatches(report.path, dataset.users)
+    else:
+        batches = lambda: sessionBatches(dataset.logins)
+    print("Cluster based on login sessions\n\n\n")
+    for k in range(2, 6):
+        with PROFILER.stage("mini-batch k-means k=" + str(k), len(dataset.logins)):
+            model, labels = clusterSessions(batches, k, len(dataset.users))
+        groups = []
+        for i in range(k):
+            groups.append([])
+        for i in range(len(report.order)):
+            if labels[report.order[i]] >= 0:
+                groups[labels[report.order[i]]].append(report.names[i])
+        print("k=" + str(k) + "\n")
+        print(groups)
+        print("held out score: " + str(round(model.score(), 4)) + (", converged" if model.converged else ""))
+
+def fileSimilaritySweep(report):
+    file_accesses = report.fileAccesses()
+    resources = report.resources
+    # similar pairs do not depend on the threshold, so they are found once (above the
+    # lowest threshold) for the whole sweep
     FILE_CORRELATION_THRESHOLD = 0.5 
+    if APPROX_SIMILARITY:
+        left, right, similarity = approxSimilarPairs(list(file_accesses.values()), [r.num_records for r in resources],
+        FILE_CORRELATION_THRESHOLD, SIMILARITY_RECALL)
+    else:
+        left, right, similarity = similarPairs(list(file_accesses.values()), [r.num_records for r in resources],
+        FILE_CORRELATION_THRESHOLD)
+    user_starts = np.searchsorted(left, np.arange(len(resources) + 1))
     while FILE_CORRELATION_THRESHOLD <= 1:
-        percent_similar_matrix = []
-        for files in file_accesses:
-            this_one = file_accesses[files] # dictionary of files to number of accesses
-            per_similars = []
-            this_num_records = resources[int(files[1:]) - 1].num_records
-            for f in file_accesses:
-                similar = 0
-                if files != f:
-                    other_one = file_accesses[f] # dictionary of files to number of accesses
-                    other_num_records = resources[int(f[1:]) - 1].num_records
-                    for accesses in this_one:
-                        cnt = this_one[accesses]
-                        othercnt = 0 if accesses not in other_one else other_one[accesses]
-                        similar += min(cnt, othercnt)
-                    per_similars.append(similar / max(this_num_records, other_num_records))
-                else:
-                    per_similars.append(-1)
-            percent_similar_matrix.append(per_similars)
-        #print("Percent Similar Matrix")
-        #print(percent_similar_matrix)
         print("Percent Similar: " + str(FILE_CORRELATION_THRESHOLD * 100) + "%")
 
-        groups = []
-        user_number_outer = 1
-        for user_list in percent_similar_matrix:
-            user_number_inner = 1
-            print("U" + str(user_number_outer) + ": ", end="")
-            for per in user_list:
-                if per > FILE_CORRELATION_THRESHOLD:
-                    print("U" + str(user_number_inner), end = " ")
-                user_number_inner += 1
-            user_number_outer += 1
+        for i in range(len(resources)):
+            print(report.names[i] + ": ", end="")
+            for k in range(user_starts[i], user_starts[i + 1]):
+                if similarity[k] > FILE_CORRELATION_THRESHOLD:
+                    print(report.names[right[k]], end = " ")
             print()
         FILE_CORRELATION_THRESHOLD += .1
         print()
         
+def fileSubsets(report):
+    file_accesses = report.fileAccesses()
     print("File accesses subsets")
     print(file_accesses)
-    cnt = 1
-    for f in file_accesses:
-        print(f, end=": ")
-        dict1 = file_accesses[f]
-        for g in file_accesses:
-            dict2 = file_accesses[g]
-            if f != g:
-                subset = True
-                for key in dict1:
-                    if key not in dict2:
-                        subset = False
-                    if key in dict2 and dict1[key] != dict2[key]:
-                        subset = False
-                if subset:
-                    print(g, end = ", ")
+    user_ids = list(file_accesses)
+    supersets = fileSupersets(list(file_accesses.values()))
+    for i in range(len(user_ids)):
+        print(user_ids[i], end=": ")
+        for j in supersets[i]:
+            print(user_ids[j], end = ", ")
         print()
 
-    prnts = []
-    [prnts.append([x.split(':')[0] for x in r.printers]) for r in resources]
-    for i in range(len(prnts)):
-        prnts[i] = rm_dup(prnts[i])
-    [print(p) for p in prnts] # prints the printers each user used without duplicates
+def printersUsed(report):
+    printers = report.dataset.printers.names
+    [print(byName([printers[p] for p in r.printers])) for r in report.resources] # the printers each user used
     
-    
-    for email in emails:
-        email.emails = rm_dup(email.emails)
+def emailAddresses(report):
+    addresses = report.dataset.addresses.names
+    directions = report.dataset.directions.names
+    programs = report.dataset.programs.names
+    for email in report.emails:
         print(email.user_id + ": " , end="")
-        print(email.emails)
-    for email in emails:
-        print(email.email_programs)
+        print(byName([addresses[a] + ":" + directions[d] for a, d in email.addresses]))
+    for email in report.emails:
+        print(byName([programs[p] for p, count in email.programs.items() for i in range(count)]))
+
+def emailClusters(report):
+    messages = report.dataset.messages
+    order = report.order
     points = []
-    email_sent_times = []
-    for email in emails:
+    email_sent_times = report.emailSentTimes()
+    for i in range(len(report.emails)):
         l = []
-        l.append(sum(removeOutliers(email.bites)) / len(removeOutliers(email.bites)))
-        l.append(sum(removeOutliers(email.attachments)) / len(removeOutliers(email.attachments)))
-        s = 0
-        start_times_seconds = []
-        for st in email.start_times:
-            tmpdt = datetime.datetime(st.year, st.month, st.day, 0, 0, 0)
-            diff = (st - tmpdt).total_seconds() # gets the time without day, month or year attached
-            start_times_seconds.append(diff)
-            stimes += diff
-            s += 1
-        ll = removeOutliers(start_times_seconds)
-        email_sent_times.append(int(sum(ll) / len(ll)))
-        l.append(int(sum(ll) / len(ll)))
+        l.append(messages.robust(order[i], "bytes").trimmed_mean)
+        l.append(messages.robust(order[i], "attachments").trimmed_mean)
+        l.append(email_sent_times[i])
         points.append(l)
     points = normalize(points)
     
     print("Cluster based on email\n\n\n")
-    
-    refs = [[0,0,0],[1,1,1]]
-    print("k=2\n")
-    print(k_meansClusterFull(refs, points))
-    
-    refs = [[0,0,0],[.5,.5,.5],[1,1,1]]
-    print("k=3\n")
-    print(k_meansClusterFull(refs, points))
-    
-    refs = [[0,0,0],[.3,.3,.3],[.6,.6,.6],[1,1,1]]
-    print("k=4\n")
-    print(k_meansClusterFull(refs, points))
-    
-    refs = [[0,0,0],[.25,.25,.25],[.5,.5,.5],[.75,.75,.75],[1,1,1]]
-    print("k=5\n")
-    print(k_meansClusterFull(refs, points))       
+    printClusters(report, "email", points)
 
+def emailStats(report):
+    messages = report.dataset.messages
+    order = report.order
+    email_sent_times = report.emailSentTimes()
     print("\n\nEmail statistics\n")
     
     print("Bites, attachments, time, machines, email programs")
     
     i = 0
-    for email in emails:
+    for email in report.emails:
         print(email.user_id, end = ": ")
-        print(sum(removeOutliers(email.bites)) / len(removeOutliers(email.bites)), end=", ")
-        print(sum(removeOutliers(email.attachments)) / len(removeOutliers(email.attachments)), end=", ")
+        print(str(messages.robust(order[i], "bytes").trimmed_mean) + errorBound(messages.robust(order[i], "bytes")), end=", ")
+        print(str(messages.robust(order[i], "attachments").trimmed_mean) + errorBound(messages.robust(order[i], "attachments")), end=", ")
         print(secondsToFormattedTime(email_sent_times[i]), end = ", ")
         i += 1
-        print(rm_dup(email.machines), end = ", ")
-        print(rm_dup(email.email_programs))
+        print(byName([report.dataset.machines.names[m] for m in email.machines]), end = ", ")
+        print(byName([report.dataset.programs.names[p] for p in email.programs]))
+
+# the login, program and email features of the clustering sections in one raw vector
+# per user: (user names, vectors) in report order
+def userFeatures(report):
+    logins = report.dataset.logins
+    messages = report.dataset.messages
+    order = report.order
+    average_time_worked = report.averageTimeWorked()
+    longest_day = report.longestDay()
+    average_start_time = report.averageTimeOfDay("login_of_day")
+    average_end_time = report.averageTimeOfDay("logout_of_day")
+    email_sent_times = report.emailSentTimes()
+    vectors = []
+    for i in range(len(order)):
+        vectors.append([average_time_worked[i], longest_day[i], average_start_time[i], average_end_time[i]]
+        + [logins.robust(order[i], name).trimmed_mean for name in ["ave_proc", "max_proc", "chars_typed", "cpu"]]
+        + [messages.robust(order[i], name).trimmed_mean for name in ["bytes", "attachments"]] + [email_sent_times[i]])
+    return [report.dataset.users.names[u] for u in order], vectors
+
+# the user neighbour index of a log, kept in its cache and brought up to date with
+# the log's current feature vectors
+def userNeighbours(dataset, path):
+    names, vectors = userFeatures(Report(dataset, path))
+    index_path = os.path.join(cacheDir(path), "neighbours.npz")
+    index = None
+    if USE_CACHE and os.path.exists(index_path):
+        try:
+            index = loadNeighbours(index_path)
+            index.update(names, vectors)
+        except (OSError, ValueError, KeyError) as error:
+            cacheWarning(path, error)
+            index = None
+    if index is None:
+        index = buildNeighbours(names, vectors)
+    if USE_CACHE and ownCache(cacheDir(path)):
+        try:
+            index.save(index_path)
+        except OSError as error:
+            cacheWarning(path, error)
+    return index
+
+def printNeighbours(index, user, k, radius=None):
+    if radius is None:
+        print("Users most like " + user + ":")
+        found = index.nearest(user, k)
+    else:
+        print("Users within " + str(radius) + " of " + user + ":")
+        found = index.within(user, radius)
+    for name, distance in found:
+        print(name + ": " + str(round(distance, 4)))
+
+def emailGraphStats(report):
+    graph = emailGraph(report.dataset)
+    print("\n\nEmail contacts\n")
+    print("Addresses sent to, received from, either")
+    sent = graph.contactCounts("S")
+    received = graph.contactCounts("R")
+    either = graph.contactCounts()
+    for u in report.order:
+        print(graph.users.names[u] + ": " + str(sent[u]) + ", " + str(received[u]) + ", " + str(either[u]))
+
+    print("Shared contacts")
+    left, right, shared = graph.sharedContactPairs()
+    starts = np.searchsorted(left, np.arange(len(graph.users) + 1))
+    for u in report.order:
+        others = sorted(range(starts[u], starts[u + 1]), key=lambda k: naturalKey(graph.users.names[right[k]]))
+        print(graph.users.names[u] + ": " + " ".join(graph.users.names[right[k]] + "(" + str(shared[k]) + ")" for k in others))
+
+    user_components, address_components = graph.components()
+    groups = {}
+    for u in report.order:
+        groups.setdefault(user_components[u], []).append(graph.users.names[u])
+    print("Connected components: " + str(len(groups)))
+    for c in groups:
+        print(groups[c])
+
+    weight = "messages" if SKETCH_MODE else "bytes"
+    print("Heaviest edges by " + weight)
+    for user, address, direction, messages, size, attachments in graph.heaviestEdges(EMAIL_GRAPH_TOP, weight):
+        print(user + ", " + address + ", " + direction + ": " + str(messages) + " messages, "
+        + (str(int(size)) + " bytes, " + str(int(attachments)) + " attachments" if size == size else "sizes not kept"))
+
+# (name, function, record types it reads, part); the statistics come before the
+# correlation and clustering part. Sections in ON_REQUEST_SECTIONS only run when named
+REPORT_SECTIONS = [
+    ("login-stats", loginStats, "1", "statistics"),
+    ("machine-usage", machineUsage, "1", "statistics"),
+    ("login-times", loginTimes, "1", "statistics"),
+    ("file-stats", fileStats, "2", "statistics"),
+    ("days-worked", daysWorked, "1", "statistics"),
+    ("pages-printed", pagesPrinted, "2", "statistics"),
+    ("login-clusters", loginClusters, "1", "clustering"),
+    ("program-clusters", programClusters, "1", "clustering"),
+    ("session-clusters", sessionClusters, "1", "clustering"),
+    ("file-similarity", fileSimilaritySweep, "2", "clustering"),
+    ("file-subsets", fileSubsets, "2", "clustering"),
+    ("printers", printersUsed, "2", "clustering"),
+    ("email-addresses", emailAddresses, "3", "clustering"),
+    ("email-clusters", emailClusters, "3", "clustering"),
+    ("email-stats", emailStats, "3", "clustering"),
+    ("email-graph", emailGraphStats, "3", "clustering"),
+]
+
+ON_REQUEST_SECTIONS = {"session-clusters", "email-graph"} # a pass over every session per k; a pair per shared contact
+
+def runReport(dataset, sections, path):
+    report = Report(dataset, path)
+    part = None
+    for name, func, types, section_part in REPORT_SECTIONS:
+        if name not in sections:
+            continue
+        if part == "statistics" and section_part == "clustering":
+            print("\n\n\n\n\n\n\n\nEnd of statistics...beginning of correlation and clustering\n\n\n")
+        part = section_part
+        PROFILER.section(name, len(report.order))
+        func(report)
+
+def main():
+    global PROFILE, PROFILE_MEMORY, PROFILE_OUTPUT, SKETCH_MODE, APPROX_SIMILARITY, SIMILARITY_RECALL, USE_CACHE, CACHE_ROOT
+    names = [s[0] for s in REPORT_SECTIONS]
+    parser = argparse.ArgumentParser(description="Statistics and clustering of users from a log")
+    parser.add_argument("paths", nargs="*", default=["sorted-proj-data.csv"], metavar="path",
+    help="log to report on (csv or xlsx), or logs to follow")
+    parser.add_argument("--sections", help="comma separated sections to print: " + ", ".join(names)
+    + " (default all but " + ", ".join(sorted(ON_REQUEST_SECTIONS)) + ")")
+    parser.add_argument("--machine-csv", help="write the user x machine login matrix to this csv file")
+    parser.add_argument("--machines", default=MACHINE_RANGE,
+    help="machines the matrix has columns for even if unused (default " + MACHINE_RANGE + "; \"\" for only the machines logged in to)")
+    parser.add_argument("--save-profiles", metavar="PATH", help="also write per user anomaly baselines of the log here")
+    parser.add_argument("--score", metavar="PROFILES", help="score every record of the log against saved baselines")
+    parser.add_argument("--top", type=int, default=20, help="with --score, how many of the highest scores to list")
+    parser.add_argument("--follow", action="store_true", help="tail the logs and serve rolling statistics as json")
+    parser.add_argument("--from-start", action="store_true", help="with --follow, read the logs from the beginning")
+    parser.add_argument("--port", type=int, default=FOLLOW_PORT, help="with --follow, port the statistics are served on")
+    parser.add_argument("--similar", metavar="USER", help="list the users whose login, program and email features are nearest USER's")
+    parser.add_argument("--neighbours", type=int, default=5, help="with --similar, how many users to list")
+    parser.add_argument("--radius", type=float, help="with --similar, list every user within this distance instead")
+    parser.add_argument("--sketch", action="store_true",
+    help="approximate outlier trimming with per user quantile sketches, in constant memory per user")
+    parser.add_argument("--approx-similarity", action="store_true",
+    help="find similar file users with MinHash/LSH instead of comparing every pair")
+    parser.add_argument("--similarity-recall", type=float, default=SIMILARITY_RECALL,
+    help="with --approx-similarity, share of the truly similar pairs to find (default %(default)s)")
+    parser.add_argument("--profile", nargs="?", const="", metavar="JSON",
+    help="time each part of the run; printed to stderr, or written to JSON if given")
+    parser.add_argument("--profile-memory", action="store_true", help="with --profile, also the peak memory of each part (slower)")
+    parser.add_argument("--no-cache", action="store_true", help="parse the log every time and write no cache")
+    parser.add_argument("--cache-dir", metavar="DIR", help="keep parsed logs here (default " + defaultCacheRoot() + ")")
+    args = parser.parse_args()
+    if args.no_cache:
+        USE_CACHE = False
+    if args.cache_dir:
+        CACHE_ROOT = args.cache_dir
+    if args.sketch:
+        SKETCH_MODE = True
+    if args.approx_similarity:
+        APPROX_SIMILARITY = True
+    SIMILARITY_RECALL = args.similarity_recall
+    if args.profile is not None:
+        PROFILE = True
+        PROFILE_OUTPUT = args.profile or None
+    if args.profile_memory:
+        PROFILE_MEMORY = True
+    if args.follow:
+        try:
+            asyncio.run(follow(args.paths, args.port, args.from_start))
+        except KeyboardInterrupt:
+            pass
+        return
+    if len(args.paths) != 1:
+        parser.error("the report reads one log")
+    path = args.paths[0]
+    if args.score:
+        dataset = ingest(path)
+        printAnomalies(dataset, loadProfiles(args.score).scoreDataset(dataset), args.top)
+        return
+    if args.similar:
+        index = userNeighbours(ingestCached(path, sketch=SKETCH_MODE), path)
+        if args.similar not in index.rows:
+            parser.error("no user " + args.similar + " in " + path)
+        printNeighbours(index, args.similar, args.neighbours, args.radius)
+        return
+    global MACHINE_MATRIX_CSV, MACHINE_COLUMNS
+    if args.machine_csv:
+        MACHINE_MATRIX_CSV = args.machine_csv
+    MACHINE_COLUMNS = machineNames(args.machines)
+    sections = [name for name in names if name not in ON_REQUEST_SECTIONS]
+    if args.sections:
+        sections = [s.strip() for s in args.sections.split(",") if s.strip()]
+        unknown = [s for s in sections if s not in names]
+        if unknown:
+            parser.error("unknown section " + ", ".join(unknown) + "; sections are " + ", ".join(names))
+    types = "".join(t for t in RECORD_TYPES if any(s[2] == t for s in REPORT_SECTIONS if s[0] in sections))
+
+    PROFILER.reset(PROFILE, PROFILE_MEMORY)
+    PROFILER.section("parse")
+    dataset = ingestCached(path, sketch=SKETCH_MODE, types=types)
+    PROFILER.end(len(dataset.logins) + len(dataset.accesses) + len(dataset.messages))
+    runReport(dataset, sections, path)
+    if args.save_profiles:
+        if types != RECORD_TYPES:
+            dataset = ingestCached(path, sketch=SKETCH_MODE)
+        buildProfiles(dataset).save(args.save_profiles)
+    PROFILER.finish()
+    if PROFILE and PROFILE_OUTPUT:
+        with open(PROFILE_OUTPUT, "w") as file:
+            file.write(PROFILER.json())
+    elif PROFILE:
+        print(PROFILER.table(), file=sys.stderr)
         
     
     